@@ -1,5 +1,5 @@
 # app/__init__.py
-from bson import ObjectId
+import os
 from flask import Flask
 from flask_pymongo import PyMongo
 from flask_login import LoginManager
@@ -13,38 +13,174 @@ csrf = CSRFProtect()
 
 def create_app():
     app = Flask(__name__)
+    from app.passwords import password_hasher, default_workers
 
     # Configurations
     app.config["SECRET_KEY"] = "supersecretkey"  # 🔐 replace with env var in production
     app.config["MONGO_URI"] = "mongodb://localhost:27017/ridehailing"
+    app.config["NEARBY_DRIVERS_RADIUS_KM"] = 10
+    app.config["NEARBY_DRIVERS_LIMIT"] = 10
+    # "manual": drivers accept rides themselves; "auto": the dispatcher assigns them every tick
+    app.config["DISPATCH_MODE"] = os.getenv("DISPATCH_MODE", "manual")
+    app.config["DISPATCH_STRATEGY"] = os.getenv("DISPATCH_STRATEGY", "greedy")  # or "optimal"
+    app.config["DISPATCH_INTERVAL_SECONDS"] = float(os.getenv("DISPATCH_INTERVAL_SECONDS", 5))
+    app.config["DISPATCH_MAX_PICKUP_KM"] = 15
+    # Ride status push: set RIDE_STATUS_CHANGE_STREAM=1 on a replica set to fan out across processes
+    app.config["RIDE_STATUS_CHANGE_STREAM"] = os.getenv("RIDE_STATUS_CHANGE_STREAM") == "1"
+    app.config["RIDE_STREAM_HEARTBEAT_SECONDS"] = 15
+    app.config["RIDE_STREAM_MAX_SECONDS"] = 300
+    # Cache for Flask-Login's per-request user lookup; set USER_CACHE_ENABLED=0 in tests
+    app.config["USER_CACHE_ENABLED"] = os.getenv("USER_CACHE_ENABLED", "1") == "1"
+    app.config["USER_CACHE_SIZE"] = 10_000
+    app.config["USER_CACHE_TTL_SECONDS"] = 300
+    app.config["RIDES_PAGE_SIZE"] = 20
+    app.config["RIDES_MAX_PAGE_SIZE"] = 100
+    # Driver GPS pings: coalesce in memory and bulk-write every N ms or M drivers
+    app.config["LOCATION_BUFFER_ENABLED"] = os.getenv("LOCATION_BUFFER_ENABLED", "1") == "1"
+    app.config["LOCATION_FLUSH_INTERVAL_MS"] = 500
+    app.config["LOCATION_FLUSH_BATCH"] = 1_000
+    app.config["LOCATION_BUFFER_MAX_PENDING"] = 10_000
+    # Password hashing: Werkzeug method spec (e.g. "scrypt", "pbkdf2:sha256:600000"), run on a process pool.
+    # Hashes made under an older method/cost are upgraded on the next successful login.
+    app.config["PASSWORD_HASH_METHOD"] = os.getenv("PASSWORD_HASH_METHOD", "scrypt")
+    app.config["PASSWORD_HASH_WORKERS"] = int(os.getenv("PASSWORD_HASH_WORKERS", default_workers()))  # 0 = inline
+    app.config["PASSWORD_HASH_MAX_QUEUE"] = 32
+    app.config["PASSWORD_HASH_TIMEOUT_SECONDS"] = 10
+    # Local gazetteer (CSV: name,lat,lng,weight) for autocomplete and geocoding
+    app.config["PLACES_FILE"] = os.getenv("PLACES_FILE", os.path.join(app.root_path, "data", "places.csv"))
+    # Fares: base + per km + per minute (haversine distance at 40 km/h), times the pickup cell's surge
+    app.config["PRICING_CURRENCY"] = "KES"
+    app.config["PRICING_BASE_FARE"] = 100.0
+    app.config["PRICING_PER_KM"] = 50.0
+    app.config["PRICING_PER_MINUTE"] = 4.0
+    app.config["PRICING_MINIMUM_FARE"] = 200.0
+    # Surge per ~2 km cell from pending rides vs available drivers, rebuilt at most once per refresh period
+    app.config["SURGE_CELL_DEG"] = 0.02
+    app.config["SURGE_REFRESH_SECONDS"] = 60
+    app.config["SURGE_SENSITIVITY"] = 0.5  # +0.5x per extra ride per driver
+    app.config["SURGE_MIN_DEMAND"] = 3
+    app.config["SURGE_MAX"] = 3.0
+    # Driver demand heatmap: ride requests per geohash cell per 5-minute bucket over a rolling window
+    app.config["DEMAND_HEATMAP_ENABLED"] = os.getenv("DEMAND_HEATMAP_ENABLED", "1") == "1"
+    app.config["DEMAND_GEOHASH_PRECISION"] = 6  # ~1.2 x 0.6 km cells
+    app.config["DEMAND_BUCKET_SECONDS"] = 300
+    app.config["DEMAND_WINDOW_BUCKETS"] = 6  # last 30 minutes
+    app.config["DEMAND_TILE_ZOOM"] = 13  # tiles are served at this zoom only; Leaflet scales them
+    # Append-only ride_events log (created/accepted/started/completed/cancelled), written in batches
+    app.config["RIDE_EVENTS_BUFFERED"] = os.getenv("RIDE_EVENTS_BUFFERED", "1") == "1"
+    app.config["RIDE_EVENTS_FLUSH_INTERVAL_MS"] = 200
+    app.config["RIDE_EVENTS_FLUSH_BATCH"] = 500
+    app.config["RIDE_EVENTS_MAX_PENDING"] = 50_000
+    # Request/Mongo metrics at /metrics (Prometheus text); requests slower than this are logged with their queries (0 = off)
+    app.config["SLOW_REQUEST_MS"] = float(os.getenv("SLOW_REQUEST_MS", 0))
+    # Bearer token Prometheus sends to /metrics; unset, only logged-in admins can read it
+    app.config["METRICS_TOKEN"] = os.getenv("METRICS_TOKEN")
+    # Also count reply bytes per command; this re-encodes every reply, so leave it off outside investigations
+    app.config["MONGO_REPLY_BYTES"] = os.getenv("MONGO_REPLY_BYTES", "0") == "1"
 
-    # Init extensions
-    mongo.init_app(app)
+    # Start the hashing pool before anything spawns threads, PyMongo's monitors included (workers are forked)
+    password_hasher.configure(
+        method=app.config["PASSWORD_HASH_METHOD"],
+        workers=app.config["PASSWORD_HASH_WORKERS"],
+        max_queue=app.config["PASSWORD_HASH_MAX_QUEUE"],
+        timeout=app.config["PASSWORD_HASH_TIMEOUT_SECONDS"],
+    )
+    password_hasher.start()
+
+    # Init extensions (the command listener attributes every Mongo command to its request)
+    from app.metrics import mongo_metrics
+    mongo_metrics.reply_bytes = app.config["MONGO_REPLY_BYTES"]
+    mongo.init_app(app, event_listeners=[mongo_metrics])
     login_manager.init_app(app)
     csrf.init_app(app)
 
     login_manager.login_view = "main.login"  # redirect if not logged in
     login_manager.login_message_category = "info"
 
+    from app.places import gazetteer
+    gazetteer.load_csv(app.config["PLACES_FILE"])
+
+    # Indexes for every query the app issues (incl. the 2dsphere driver index)
+    from app.indexes import ensure_indexes, register_commands
+    from app.spatial import driver_grid
+    register_commands(app, mongo)
+    from app.reports import register_commands as register_report_commands
+    from app.ride_log import register_commands as register_ride_log_commands
+    register_report_commands(app, mongo)
+    register_ride_log_commands(app, mongo)
+    with app.app_context():
+        ensure_indexes(mongo.db)
+
+        # Warm the in-memory driver grid; later driver writes keep it current
+        driver_grid.clear()
+        driver_grid.load(mongo.db.drivers.find(
+            {"availability": True, "location": {"$ne": None}},
+            {"user_id": 1, "location": 1, "current_location": 1, "vehicle_details": 1},
+        ))
+
     # User loader for Flask-Login
     from app.models import User
     
+    from app.cache import user_cache
+    user_cache.configure(
+        maxsize=app.config["USER_CACHE_SIZE"],
+        ttl=app.config["USER_CACHE_TTL_SECONDS"],
+        enabled=app.config["USER_CACHE_ENABLED"],
+    )
+
+    from app.pricing import pricing
+    pricing.configure(
+        base_fare=app.config["PRICING_BASE_FARE"],
+        per_km=app.config["PRICING_PER_KM"],
+        per_minute=app.config["PRICING_PER_MINUTE"],
+        minimum=app.config["PRICING_MINIMUM_FARE"],
+        currency=app.config["PRICING_CURRENCY"],
+    )
+    pricing.surge.configure(
+        cell_deg=app.config["SURGE_CELL_DEG"],
+        refresh_seconds=app.config["SURGE_REFRESH_SECONDS"],
+        sensitivity=app.config["SURGE_SENSITIVITY"],
+        min_demand=app.config["SURGE_MIN_DEMAND"],
+        max_surge=app.config["SURGE_MAX"],
+    )
+
+    from app.heatmap import demand_heatmap
+    demand_heatmap.configure(
+        precision=app.config["DEMAND_GEOHASH_PRECISION"],
+        bucket_seconds=app.config["DEMAND_BUCKET_SECONDS"],
+        window_buckets=app.config["DEMAND_WINDOW_BUCKETS"],
+        tile_zoom=app.config["DEMAND_TILE_ZOOM"],
+        enabled=app.config["DEMAND_HEATMAP_ENABLED"],
+    )
+
     @login_manager.user_loader
     def load_user(user_id):
-        data = mongo.db.users.find_one({"_id": ObjectId(user_id)})
-        if data:
-            return User(
-                name=data["name"],
-                email=data["email"],
-                phone=data["phone"],
-                password_hash=data["password_hash"],  # don't re-hash
-                role=data.get("role", "customer"),
-                _id=data["_id"],
-            )
-        return None
+        return User.get_by_id(user_id)
 
     # Register blueprints
     from app.routes import main
     app.register_blueprint(main)
 
+    if app.config["LOCATION_BUFFER_ENABLED"]:
+        from app.ingest import location_buffer
+        location_buffer.flush_interval_ms = app.config["LOCATION_FLUSH_INTERVAL_MS"]
+        location_buffer.flush_batch = app.config["LOCATION_FLUSH_BATCH"]
+        location_buffer.max_pending = app.config["LOCATION_BUFFER_MAX_PENDING"]
+        location_buffer.start(mongo.db.drivers)
+
+    if app.config["RIDE_EVENTS_BUFFERED"]:
+        from app.ride_log import ride_log
+        ride_log.flush_interval_ms = app.config["RIDE_EVENTS_FLUSH_INTERVAL_MS"]
+        ride_log.flush_batch = app.config["RIDE_EVENTS_FLUSH_BATCH"]
+        ride_log.max_pending = app.config["RIDE_EVENTS_MAX_PENDING"]
+        ride_log.start(mongo.db.ride_events)
+
+    if app.config["RIDE_STATUS_CHANGE_STREAM"]:
+        from app.events import start_change_stream
+        start_change_stream(app, mongo.db.rides)
+
+    if app.config["DISPATCH_MODE"] == "auto":
+        from app.dispatch import start_dispatcher
+        start_dispatcher(app)
+
     return app
@@ -0,0 +1,248 @@
+import asyncio
+
+from bson import ObjectId
+from pymongo import ASCENDING, DESCENDING, AsyncMongoClient, ReturnDocument
+
+from .cache import user_cache
+from .geo import to_point
+from .heatmap import demand_heatmap
+from .models import (
+    DRIVER_LIST_FIELDS, PENDING_RIDE_FIELDS, RIDER_RIDE_FIELDS,
+    Driver, RideRequest, Trip, User, forget_user, load_many,
+)
+from .pagination import keyset_page_async
+from .passwords import password_hasher
+from .ride_log import log_entry, ride_log, status_entry
+from .spatial import driver_grid
+
+
+# -------------------- ASYNC MONGO --------------------
+class AsyncMongo:
+    """Counterpart of flask_pymongo's `mongo` over PyMongo's asyncio client.
+
+    `amongo.db.rides.find_one(...)` etc. are awaitable; the client connects
+    lazily on first use, inside whichever event loop serves the app.
+    """
+
+    def __init__(self):
+        self.cx = None
+        self.db = None
+
+    def init_app(self, app):
+        self.cx = AsyncMongoClient(app.config["MONGO_URI"])
+        self.db = self.cx.get_default_database()
+
+    async def close(self):
+        if self.cx is not None:
+            await self.cx.close()
+
+
+amongo = AsyncMongo()
+
+
+# The async models subclass the sync ones: construction, to_doc() and the
+# in-memory caches are shared, and each method that talks to Mongo has an
+# awaitable override with the same name and arguments.
+
+# -------------------- USER MODEL --------------------
+class AsyncUser(User):
+    __slots__ = ()
+
+    async def set_password(self, password):
+        self.password_hash = await asyncio.to_thread(password_hasher.hash, password)
+
+    async def check_password(self, password):
+        return await asyncio.to_thread(password_hasher.verify, self.password_hash, password)
+
+    async def rehash_password_if_needed(self, password):
+        if not self.id or not password_hasher.needs_rehash(self.password_hash):
+            return False
+        await self.set_password(password)
+        return await self.save_to_db()
+
+    async def save_to_db(self):
+        user_data = self.to_doc()
+        if self.id:
+            changes = self.changes()
+            if not changes:
+                return False
+            await amongo.db.users.update_one({"_id": ObjectId(self.id)}, {"$set": changes})
+            forget_user(self.id)
+        else:
+            result = await amongo.db.users.insert_one(user_data)
+            self.id = str(result.inserted_id)
+        self.mark_clean(user_data)
+        return True
+
+    @staticmethod
+    async def get_by_id(user_id):
+        # Own key in the shared cache: the WSGI app in this process must never get an AsyncUser back
+        user = user_cache.get(("async", user_id))
+        if user is not None:
+            return user
+        if not ObjectId.is_valid(user_id):
+            return None
+        data = await amongo.db.users.find_one({"_id": ObjectId(user_id)})
+        if not data:
+            return None
+        user = AsyncUser.from_doc(data)
+        user_cache.set(("async", user_id), user)
+        return user
+
+    @staticmethod
+    async def get_by_email(email):
+        data = await amongo.db.users.find_one({"email": email})
+        return AsyncUser.from_doc(data) if data else None
+
+
+# -------------------- RIDE REQUEST MODEL --------------------
+async def record_ride_events(events):
+    # record() only appends while the flusher runs, but writes inline without it; keep that off the loop
+    await asyncio.to_thread(ride_log.record, events)
+
+
+class AsyncRideRequest(RideRequest):
+    __slots__ = ()
+
+    async def save_to_db(self):
+        ride_data = self.to_doc()
+        if self.id:
+            changes = self.changes()
+            if not changes:
+                return False
+            await amongo.db.rides.update_one({"_id": ObjectId(self.id)}, {"$set": self.stamped(changes, ride_data)})
+            if "status" in changes:
+                await record_ride_events([status_entry(self.id, self.status, ride_data["updated_at"],
+                                                       driver_id=self.driver_id)])
+        else:
+            result = await amongo.db.rides.insert_one(ride_data)
+            self.id = str(result.inserted_id)
+            await asyncio.to_thread(demand_heatmap.record, self.latlng("pickup"))
+            await record_ride_events([log_entry(self.id, "created", ride_data["updated_at"], rider_id=self.rider_id)])
+        self.updated_at = ride_data["updated_at"]
+        self.mark_clean(ride_data)
+        return True
+
+    @staticmethod
+    async def get_by_id(ride_id):
+        if not ObjectId.is_valid(ride_id):
+            return None
+        data = await amongo.db.rides.find_one({"_id": ObjectId(ride_id)})
+        return AsyncRideRequest.from_doc(data) if data else None
+
+    @staticmethod
+    async def get_pending_rides():
+        return await amongo.db.rides.find({"status": "pending"}).to_list()
+
+    @staticmethod
+    async def for_rider(rider_id, after=None, limit=20, fields=RIDER_RIDE_FIELDS):
+        docs, next_cursor = await keyset_page_async(amongo.db.rides, {"rider_id": rider_id}, fields,
+                                                    after=after, limit=limit, direction=DESCENDING)
+        return load_many(AsyncRideRequest, docs, fields), next_cursor
+
+    @staticmethod
+    async def claim(ride_id, driver_id, driver_at=None, **fields):
+        query, update = RideRequest.claim_update(ride_id, driver_id, driver_at, **fields)
+        ride = await amongo.db.rides.find_one_and_update(query, update, return_document=ReturnDocument.AFTER)
+        if ride:
+            backfill = RideRequest.backfill_pickup(ride, driver_at)
+            if backfill:
+                await amongo.db.rides.update_one(*backfill)
+            await record_ride_events([log_entry(ride_id, "accepted", ride["accepted_at"], driver_id=driver_id)])
+        return ride
+
+
+# -------------------- DRIVER MODEL --------------------
+class AsyncDriver(Driver):
+    __slots__ = ()
+
+    async def save_to_db(self):
+        driver_data = self.to_doc()
+        if self.id:
+            changes = self.changes()
+            if not changes:
+                return False
+            changes["last_seen"] = driver_data["last_seen"]
+            await amongo.db.drivers.update_one({"_id": ObjectId(self.id)}, {"$set": changes})
+        else:
+            result = await amongo.db.drivers.update_one({"user_id": self.user_id}, {"$set": driver_data}, upsert=True)
+            if result.upserted_id:
+                self.id = str(result.upserted_id)
+        self.last_seen = driver_data["last_seen"]
+        self.mark_clean(driver_data)
+        self.track_saved(driver_data)
+        return True
+
+    @staticmethod
+    async def get_by_user_id(user_id):
+        data = await amongo.db.drivers.find_one({"user_id": user_id})
+        return AsyncDriver.from_doc(data) if data else None
+
+    @staticmethod
+    async def update_location(user_id, lat, lng, label=None):
+        query, update = Driver.location_update(user_id, lat, lng, label)
+        await amongo.db.drivers.update_one(query, update, upsert=True)
+        fields = update["$set"]
+        Driver.track_in_grid(user_id, lat, lng, fields["current_location"])
+        return fields["last_seen"]
+
+    @staticmethod
+    async def get_pending_rides(after=None, limit=20, fields=PENDING_RIDE_FIELDS):
+        docs, next_cursor = await keyset_page_async(amongo.db.rides, {"status": "pending"}, fields,
+                                                    after=after, limit=limit, direction=ASCENDING)
+        return load_many(AsyncRideRequest, docs, fields), next_cursor
+
+    @staticmethod
+    async def get_available_drivers(limit=50, fields=DRIVER_LIST_FIELDS):
+        docs = await amongo.db.drivers.find({"availability": True}, fields).limit(limit).to_list()
+        return load_many(AsyncDriver, docs, fields)
+
+    @staticmethod
+    async def nearest_available(lat, lng, radius_km=10, limit=10, fields=DRIVER_LIST_FIELDS):
+        query = {
+            "availability": True,
+            "location": {
+                "$nearSphere": {
+                    "$geometry": to_point(lat, lng),
+                    "$maxDistance": radius_km * 1000,
+                }
+            },
+        }
+        return load_many(AsyncDriver, await amongo.db.drivers.find(query, fields).limit(limit).to_list(), fields)
+
+    @staticmethod
+    async def nearby(lat, lng, radius_km=10, limit=10):
+        if len(driver_grid):
+            return [AsyncDriver.from_doc(payload, DRIVER_LIST_FIELDS)
+                    for _, _, payload in driver_grid.nearest(lat, lng, k=limit, radius_km=radius_km)]
+        return await AsyncDriver.nearest_available(lat, lng, radius_km=radius_km, limit=limit)
+
+
+# -------------------- TRIP MODEL --------------------
+class AsyncTrip(Trip):
+    __slots__ = ()
+
+    async def save_to_db(self):
+        trip_data = self.to_doc()
+        if self.id:
+            changes = self.changes()
+            if not changes:
+                return False
+            await amongo.db.trips.update_one({"_id": ObjectId(self.id)}, {"$set": self.stamped(changes, trip_data)})
+        else:
+            result = await amongo.db.trips.insert_one(trip_data)
+            self.id = str(result.inserted_id)
+        self.updated_at = trip_data["updated_at"]
+        self.mark_clean(trip_data)
+        return True
+
+    @staticmethod
+    async def get_by_id(trip_id):
+        if not ObjectId.is_valid(trip_id):
+            return None
+        data = await amongo.db.trips.find_one({"_id": ObjectId(trip_id)})
+        return AsyncTrip.from_doc(data) if data else None
+
+    @staticmethod
+    async def get_by_ride_request(ride_request_id):
+        return await amongo.db.trips.find_one({"ride_request_id": ride_request_id})
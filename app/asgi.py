@@ -0,0 +1,153 @@
+"""ASGI entry point.
+
+    uvicorn --factory app.asgi:create_asgi_app
+
+Ride status polling and the SSE stream are served natively on the event loop
+through the async models, so each open connection costs a coroutine rather
+than a worker thread. Every other route is handed to the Flask app through
+asgiref's WSGI adapter (installed with `flask[async]`).
+"""
+import asyncio
+import json
+import re
+import time
+from http.cookies import SimpleCookie
+
+from asgiref.wsgi import WsgiToAsgi
+from bson import ObjectId
+from itsdangerous import BadSignature
+
+from . import create_app
+from .aio import AsyncUser, amongo
+from .events import format_sse, ride_event, ride_hub
+
+
+def create_asgi_app(flask_app=None):
+    flask_app = flask_app or create_app()
+    amongo.init_app(flask_app)
+    return AsyncRideApp(flask_app)
+
+
+class AsyncRideApp:
+    def __init__(self, flask_app):
+        self.flask_app = flask_app
+        self.wsgi = WsgiToAsgi(flask_app)
+        self.routes = [
+            (re.compile(r"^/api/ride_status/stream$"), self.ride_status_stream),
+            (re.compile(r"^/api/ride_status/(?P<ride_id>[^/]+)$"), self.ride_status),
+        ]
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            return await self.lifespan(receive, send)
+        if scope["type"] == "http" and scope["method"] == "GET":
+            for pattern, handler in self.routes:
+                match = pattern.match(scope["path"])
+                if match:
+                    return await handler(scope, receive, send, **match.groupdict())
+        return await self.wsgi(scope, receive, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await amongo.close()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    # -------------------- SESSION --------------------
+    async def current_user(self, scope):
+        """The logged-in user from Flask's signed session cookie, as Flask-Login would see it."""
+        app = self.flask_app
+        cookies = SimpleCookie()
+        for name, value in scope.get("headers", []):
+            if name == b"cookie":
+                cookies.load(value.decode("latin-1"))
+        morsel = cookies.get(app.config["SESSION_COOKIE_NAME"])
+        serializer = app.session_interface.get_signing_serializer(app)
+        if morsel is None or serializer is None:
+            return None
+        try:
+            session = serializer.loads(morsel.value, max_age=int(app.permanent_session_lifetime.total_seconds()))
+        except BadSignature:
+            return None
+        user_id = session.get("_user_id")
+        return await AsyncUser.get_by_id(user_id) if user_id else None
+
+    # -------------------- ROUTES --------------------
+    async def ride_status(self, scope, receive, send, ride_id):
+        if await self.current_user(scope) is None:
+            return await send_json(send, {"error": "login required"}, status=401)
+        ride = None
+        if ObjectId.is_valid(ride_id):
+            ride = await amongo.db.rides.find_one({"_id": ObjectId(ride_id)}, {"status": 1})
+        if ride:
+            return await send_json(send, {"status": ride.get("status", "unknown")})
+        return await send_json(send, {"status": "not found"})
+
+    async def ride_status_stream(self, scope, receive, send):
+        user = await self.current_user(scope)
+        if user is None:
+            return await send_json(send, {"error": "login required"}, status=401)
+        rider_id = user.id
+        heartbeat = self.flask_app.config["RIDE_STREAM_HEARTBEAT_SECONDS"]
+        max_age = self.flask_app.config["RIDE_STREAM_MAX_SECONDS"]
+
+        # Subscribe before the snapshot so nothing slips in between
+        sub = ride_hub.subscribe_async(rider_id)
+        disconnected = asyncio.ensure_future(wait_for_disconnect(receive))
+        try:
+            snapshot = await amongo.db.rides.find(
+                {"rider_id": rider_id, "status": {"$in": ["pending", "accepted", "in_progress"]}},
+                {"status": 1, "eta": 1, "match_code": 1},
+            ).to_list()
+            await send({
+                "type": "http.response.start",
+                "status": 200,
+                "headers": [
+                    (b"content-type", b"text/event-stream; charset=utf-8"),
+                    (b"cache-control", b"no-cache"),
+                    (b"x-accel-buffering", b"no"),
+                ],
+            })
+            await send_chunk(send, f"retry: {heartbeat * 1000}\n\n")
+            for ride in snapshot:
+                await send_chunk(send, format_sse(ride_event(ride), "ride"))
+
+            deadline = time.monotonic() + max_age
+            while time.monotonic() < deadline and not disconnected.done():
+                get = asyncio.ensure_future(sub.queue.get())
+                done, _ = await asyncio.wait({get, disconnected}, timeout=heartbeat,
+                                             return_when=asyncio.FIRST_COMPLETED)
+                if get in done:
+                    await send_chunk(send, format_sse(get.result(), "ride"))
+                else:
+                    get.cancel()
+                    if not disconnected.done():
+                        await send_chunk(send, ": keep-alive\n\n")
+            if not disconnected.done():
+                await send({"type": "http.response.body", "body": b""})
+        finally:
+            disconnected.cancel()
+            ride_hub.unsubscribe(rider_id, sub)
+
+
+async def wait_for_disconnect(receive):
+    while (await receive())["type"] != "http.disconnect":
+        pass
+
+
+async def send_chunk(send, text):
+    await send({"type": "http.response.body", "body": text.encode(), "more_body": True})
+
+
+async def send_json(send, data, status=200):
+    body = json.dumps(data).encode()
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+    })
+    await send({"type": "http.response.body", "body": body})
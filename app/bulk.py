@@ -0,0 +1,97 @@
+from collections import namedtuple
+
+from bson import ObjectId
+from pymongo import InsertOne, UpdateOne
+from pymongo.errors import BulkWriteError
+
+# Outcome of one item of a bulk model operation; error is None when ok
+BulkResult = namedtuple("BulkResult", ["id", "ok", "error"])
+
+
+# -------------------- BULK WRITES --------------------
+def bulk_write_items(collection, keys, ops, ordered=False):
+    """Run `ops` as one bulk_write and report a BulkResult per op (keyed by `keys`).
+
+    Returns (results, counts). Unordered writes apply every op they can; ordered
+    writes stop at the first error, and the ops after it come back as "not attempted".
+    """
+    counts = {"matched": 0, "modified": 0, "inserted": 0, "upserted": 0, "upserted_ids": {}}
+    if not ops:
+        return [], counts
+    errors = {}
+    try:
+        result = collection.bulk_write(ops, ordered=ordered)
+        counts = {
+            "matched": result.matched_count,
+            "modified": result.modified_count,
+            "inserted": result.inserted_count,
+            "upserted": result.upserted_count,
+            "upserted_ids": result.upserted_ids or {},
+        }
+    except BulkWriteError as exc:
+        details = exc.details
+        counts = {"matched": details["nMatched"], "modified": details["nModified"],
+                  "inserted": details["nInserted"], "upserted": details["nUpserted"],
+                  "upserted_ids": {u["index"]: u["_id"] for u in details.get("upserted", [])}}
+        for err in details["writeErrors"]:
+            errors[err["index"]] = err.get("errmsg", "write error")
+        if ordered and errors:
+            for i in range(min(errors) + 1, len(ops)):
+                errors[i] = "not attempted"
+    return [BulkResult(key, i not in errors, errors.get(i)) for i, key in enumerate(keys)], counts
+
+
+def save_models(collection, models, ordered=False):
+    """Insert the models without an id and $set the changed fields of the rest, in one bulk write.
+
+    Unchanged models are skipped (reported ok). New models get their id assigned
+    on success. Returns a BulkResult per model, in order.
+    """
+    models = list(models)
+    ids, ops, written, unchanged = [], [], [], []
+    for model in models:
+        doc = model.to_doc()
+        if not model.id:
+            doc["_id"] = ObjectId()
+            ops.append(InsertOne(doc))
+        else:
+            changes = model.changes()
+            if not changes:
+                ids.append(model.id)
+                unchanged.append(BulkResult(model.id, True, None))
+                continue
+            ops.append(UpdateOne({"_id": ObjectId(model.id)}, {"$set": model.stamped(changes, doc)}))
+        ids.append(model.id or str(doc["_id"]))
+        written.append((model, doc))
+    results, _ = bulk_write_items(collection, [model.id or str(doc["_id"]) for model, doc in written], ops, ordered)
+    for (model, doc), result in zip(written, results):
+        if result.ok:
+            model.id = result.id
+            doc.pop("_id", None)
+            model.mark_clean(doc)
+    return in_order(ids, results + unchanged, "not attempted")
+
+
+def update_by_ids(collection, updates, ordered=False):
+    """Apply [(id, update)] as one bulk write; ids that are invalid or match nothing come back not ok."""
+    updates = [(str(i), update) for i, update in updates]
+    valid = [(i, update) for i, update in updates if ObjectId.is_valid(i)]
+    results, counts = bulk_write_items(
+        collection, [i for i, _ in valid], [UpdateOne({"_id": ObjectId(i)}, update) for i, update in valid], ordered
+    )
+    if counts["matched"] < sum(r.ok for r in results):
+        # Only a count comes back, so look up which ids exist
+        found = {str(doc["_id"]) for doc in collection.find({"_id": {"$in": [ObjectId(i) for i, _ in valid]}}, {"_id": 1})}
+        results = mark_failed(results, {r.id for r in results} - found, "not found")
+    return in_order([i for i, _ in updates], results, "invalid id")
+
+
+def in_order(ids, results, missing_error):
+    """Results lined up with `ids`; ids with no result get `missing_error`."""
+    by_id = {r.id: r for r in results}
+    return [by_id.get(i) or BulkResult(i, False, missing_error) for i in ids]
+
+
+def mark_failed(results, failed, error):
+    """Turn the ok results whose id is in `failed` into errors."""
+    return [BulkResult(r.id, False, error) if r.ok and r.id in failed else r for r in results]
@@ -0,0 +1,226 @@
+import random
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+
+from . import mongo
+from .events import ride_hub
+from .geo import doc_latlng, parse_latlng, eta_matrix
+from .models import RideRequest, Driver
+
+
+# -------------------- ASSIGNMENT --------------------
+def greedy_assignment(cost, max_cost=np.inf):
+    """Nearest-first matching: repeatedly take the cheapest unused (ride, driver) pair."""
+    pairs = []
+    if cost.size == 0:
+        return pairs
+    used_rows, used_cols = set(), set()
+    for flat in np.argsort(cost, axis=None, kind="stable"):
+        i, j = divmod(int(flat), cost.shape[1])
+        if cost[i, j] > max_cost:
+            break
+        if i in used_rows or j in used_cols:
+            continue
+        pairs.append((i, j))
+        used_rows.add(i)
+        used_cols.add(j)
+        if len(used_rows) == cost.shape[0] or len(used_cols) == cost.shape[1]:
+            break
+    return pairs
+
+
+def optimal_assignment(cost, max_cost=np.inf):
+    """Minimum total cost matching (Hungarian algorithm, O(n^3)) on a rectangular matrix."""
+    n_rows, n_cols = cost.shape
+    if not n_rows or not n_cols:
+        return []
+
+    # Pairs over max_cost are allowed in the solve but priced out, then dropped
+    big = float(np.nanmax(np.where(np.isfinite(cost), cost, 0))) * (n_rows + n_cols) + 1.0
+    priced = np.where(cost > max_cost, big, cost)
+
+    transpose = n_rows > n_cols
+    if transpose:
+        priced = priced.T
+    n, m = priced.shape  # n <= m
+
+    # Shortest augmenting path with potentials (1-indexed, column 0 is a sentinel)
+    u = np.zeros(n + 1)
+    v = np.zeros(m + 1)
+    match = np.zeros(m + 1, dtype=int)  # match[col] = row
+    way = np.zeros(m + 1, dtype=int)
+    for i in range(1, n + 1):
+        match[0] = i
+        j0 = 0
+        minv = np.full(m + 1, np.inf)
+        used = np.zeros(m + 1, dtype=bool)
+        while True:
+            used[j0] = True
+            i0 = match[j0]
+            free = ~used[1:]
+            cur = priced[i0 - 1] - u[i0] - v[1:]
+            better = free & (cur < minv[1:])
+            minv[1:][better] = cur[better]
+            way[1:][better] = j0
+            candidates = np.where(free, minv[1:], np.inf)
+            j1 = int(np.argmin(candidates)) + 1
+            delta = candidates[j1 - 1]
+            u[match[used]] += delta
+            v[used] -= delta
+            minv[1:][free] -= delta
+            j0 = j1
+            if match[j0] == 0:
+                break
+        while j0:
+            j1 = way[j0]
+            match[j0] = match[j1]
+            j0 = j1
+
+    pairs = []
+    for j in range(1, m + 1):
+        if match[j]:
+            i, jj = int(match[j]) - 1, j - 1
+            pair = (jj, i) if transpose else (i, jj)
+            if cost[pair] <= max_cost:
+                pairs.append(pair)
+    return sorted(pairs)
+
+
+STRATEGIES = {
+    "greedy": greedy_assignment,
+    "optimal": optimal_assignment,
+}
+
+
+# -------------------- DISPATCHER --------------------
+class Dispatcher:
+    """Matches all pending rides to available drivers in one pass per tick."""
+
+    def __init__(self, strategy="greedy", speed_kmh=40, max_pickup_km=15):
+        if strategy not in STRATEGIES:
+            raise ValueError(f"Unknown dispatch strategy: {strategy}")
+        self.strategy = strategy
+        self.speed_kmh = speed_kmh
+        self.max_pickup_km = max_pickup_km
+        self.metrics = {
+            "ticks": 0,
+            "rides_assigned": 0,
+            "last_tick_ms": 0.0,
+            "last_assign_ms": 0.0,
+            "max_tick_ms": 0.0,
+            "total_tick_ms": 0.0,
+        }
+        self._lock = threading.Lock()
+
+    def tick(self):
+        """Run one dispatch round. Returns the list of (ride_id, driver_user_id) assigned.
+
+        A ride accepted manually in the meantime is skipped by the conditional update.
+        """
+        started = time.perf_counter()
+
+        rides, pickups = [], []
+        for ride in RideRequest.get_pending_rides():
+            latlng = doc_latlng(ride, "pickup")
+            if latlng:
+                rides.append(ride)
+                pickups.append(latlng)
+
+        # Drivers already carrying a ride aren't offered another one
+        busy = set(mongo.db.rides.distinct("driver_id", {"status": {"$in": ["accepted", "in_progress"]}}))
+        drivers, positions, seen = [], [], set()
+        for driver in Driver.get_available_drivers(limit=0, fields={"user_id": 1, "current_location": 1}):
+            latlng = parse_latlng(driver.current_location)
+            if latlng and driver.user_id not in busy and driver.user_id not in seen:
+                seen.add(driver.user_id)
+                drivers.append(driver)
+                positions.append(latlng)
+
+        assigned = []
+        written = 0
+        assign_ms = 0.0
+        if rides and drivers:
+            eta = eta_matrix(pickups, positions, self.speed_kmh)
+            t0 = time.perf_counter()
+            pairs = STRATEGIES[self.strategy](eta.km, self.max_pickup_km)
+            assign_ms = (time.perf_counter() - t0) * 1000
+
+            now = datetime.utcnow()
+            claims, updates = [], {}
+            for i, j in pairs:
+                seconds = float(eta.seconds[i, j])
+                fields = {
+                    "match_code": random.randint(10000, 99999),
+                    "eta": f"{int(seconds // 60)} min",
+                    "eta_km": round(float(eta.km[i, j]), 3),
+                    "eta_seconds": int(seconds),
+                    "accepted_at": now,
+                    "dispatched": True,
+                }
+                ride_id = str(rides[i]["_id"])
+                claims.append((ride_id, drivers[j].user_id, fields))
+                updates[ride_id] = {**rides[i], **fields, "status": "accepted", "driver_id": drivers[j].user_id}
+
+            # Conditional on status=pending, so a ride accepted manually in the meantime is left alone
+            won = [result.id for result in RideRequest.bulk_assign(claims) if result.ok]
+            written = len(won)
+            updates = [updates[ride_id] for ride_id in won]
+
+            for ride in updates:
+                ride_hub.publish_ride(ride)
+                assigned.append((str(ride["_id"]), ride["driver_id"]))
+
+        tick_ms = (time.perf_counter() - started) * 1000
+        with self._lock:
+            m = self.metrics
+            m["ticks"] += 1
+            m["rides_assigned"] += written
+            m["last_tick_ms"] = round(tick_ms, 3)
+            m["last_assign_ms"] = round(assign_ms, 3)
+            m["max_tick_ms"] = round(max(m["max_tick_ms"], tick_ms), 3)
+            m["total_tick_ms"] += tick_ms
+        return assigned
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.metrics)
+        stats["avg_tick_ms"] = round(stats["total_tick_ms"] / stats["ticks"], 3) if stats["ticks"] else 0.0
+        stats["strategy"] = self.strategy
+        return stats
+
+
+# -------------------- BACKGROUND LOOP --------------------
+dispatcher = Dispatcher()
+_stop = threading.Event()
+
+
+def start_dispatcher(app):
+    """Run dispatcher.tick() every DISPATCH_INTERVAL_SECONDS on a daemon thread."""
+    if app.config["DISPATCH_STRATEGY"] not in STRATEGIES:
+        raise ValueError(f"Unknown dispatch strategy: {app.config['DISPATCH_STRATEGY']}")
+    dispatcher.strategy = app.config["DISPATCH_STRATEGY"]
+    dispatcher.max_pickup_km = app.config["DISPATCH_MAX_PICKUP_KM"]
+    interval = app.config["DISPATCH_INTERVAL_SECONDS"]
+    _stop.clear()
+
+    def run():
+        while not _stop.wait(interval):
+            with app.app_context():
+                try:
+                    assigned = dispatcher.tick()
+                    if assigned:
+                        app.logger.info("dispatch: assigned %d rides in %.1f ms",
+                                        len(assigned), dispatcher.metrics["last_tick_ms"])
+                except Exception:
+                    app.logger.exception("dispatch tick failed")
+
+    thread = threading.Thread(target=run, name="ride-dispatcher", daemon=True)
+    thread.start()
+    return thread
+
+
+def stop_dispatcher():
+    _stop.set()
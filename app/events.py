@@ -0,0 +1,126 @@
+import asyncio
+import json
+import queue
+import threading
+import time
+
+
+# -------------------- RIDE STATUS HUB --------------------
+class RideStatusHub:
+    """In-process publish/subscribe of ride status changes, keyed by rider.
+
+    Each subscriber gets a bounded queue; a slow client that lets it fill up
+    just misses events (the stream sends a fresh snapshot on reconnect).
+    """
+
+    def __init__(self, max_queue=100):
+        self.max_queue = max_queue
+        self.use_change_stream = False
+        self._subscribers = {}  # rider_id -> set of queues
+        self._lock = threading.Lock()
+
+    def subscribe(self, rider_id):
+        q = queue.Queue(maxsize=self.max_queue)
+        with self._lock:
+            self._subscribers.setdefault(rider_id, set()).add(q)
+        return q
+
+    def subscribe_async(self, rider_id):
+        """Like subscribe(), but for a coroutine on the running event loop: await `sub.queue.get()`."""
+        sub = AsyncSubscriber(asyncio.get_running_loop(), self.max_queue)
+        with self._lock:
+            self._subscribers.setdefault(rider_id, set()).add(sub)
+        return sub
+
+    def unsubscribe(self, rider_id, q):
+        with self._lock:
+            subs = self._subscribers.get(rider_id)
+            if subs:
+                subs.discard(q)
+                if not subs:
+                    del self._subscribers[rider_id]
+
+    def subscriber_count(self):
+        with self._lock:
+            return sum(len(subs) for subs in self._subscribers.values())
+
+    def publish(self, rider_id, event):
+        with self._lock:
+            subs = list(self._subscribers.get(rider_id, ()))
+        for q in subs:
+            try:
+                q.put_nowait(event)
+            except queue.Full:
+                pass
+
+    def publish_ride(self, ride, source="local"):
+        """Publish a ride document's status. Local publishes are skipped when the change stream is the source."""
+        if self.use_change_stream and source == "local":
+            return
+        if ride.get("rider_id"):
+            self.publish(ride["rider_id"], ride_event(ride))
+
+
+class AsyncSubscriber:
+    """Hub subscriber backed by an asyncio.Queue; publish() may be called from any thread."""
+
+    def __init__(self, loop, maxsize):
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize)
+
+    def put_nowait(self, event):
+        try:
+            self.loop.call_soon_threadsafe(self._put, event)
+        except RuntimeError:  # loop already closed
+            pass
+
+    def _put(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            pass
+
+
+def ride_event(ride):
+    return {
+        "ride_id": str(ride["_id"]),
+        "status": ride.get("status", "unknown"),
+        "eta": ride.get("eta"),
+        "match_code": ride.get("match_code"),
+    }
+
+
+def format_sse(data, event=None):
+    msg = f"data: {json.dumps(data)}\n\n"
+    if event:
+        msg = f"event: {event}\n{msg}"
+    return msg
+
+
+ride_hub = RideStatusHub()
+
+
+# -------------------- CHANGE STREAM SOURCE --------------------
+def start_change_stream(app, collection):
+    """Feed ride_hub from a MongoDB change stream (needs a replica set).
+
+    Every app process then sees changes made by any process, not just its own.
+    """
+    ride_hub.use_change_stream = True
+    pipeline = [{"$match": {"operationType": {"$in": ["insert", "update", "replace"]}}}]
+
+    def run():
+        while True:
+            try:
+                with collection.watch(pipeline, full_document="updateLookup") as stream:
+                    for change in stream:
+                        doc = change.get("fullDocument")
+                        if doc:
+                            ride_hub.publish_ride(doc, source="change_stream")
+            except Exception:
+                app.logger.exception("ride change stream interrupted, reconnecting")
+                time.sleep(5)
+
+    thread = threading.Thread(target=run, name="ride-change-stream", daemon=True)
+    thread.start()
+    return thread
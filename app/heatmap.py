@@ -0,0 +1,102 @@
+import calendar
+import logging
+from datetime import datetime, timedelta
+
+from pymongo import UpdateOne
+from pymongo.errors import PyMongoError
+
+from . import mongo
+from .geo import geohash, geohashes_in_bbox, tile_bounds
+
+log = logging.getLogger(__name__)
+
+EPOCH = datetime(1970, 1, 1)
+
+
+# -------------------- DEMAND HEATMAP --------------------
+class DemandHeatmap:
+    """Rolling ride-request counts per geohash cell per time bucket.
+
+    Each new ride $incs one small `demand_cells` document ({cell, bucket,
+    count}); documents expire through a TTL index once their bucket has left
+    the window. A map tile reads only the cells inside it for the buckets in
+    the window, so its cost is O(cells in view), never a scan of `rides`.
+    """
+
+    def __init__(self, precision=6, bucket_seconds=300, window_buckets=6, tile_zoom=13, enabled=True):
+        self.precision = precision
+        self.bucket_seconds = bucket_seconds
+        self.window_buckets = window_buckets
+        self.tile_zoom = tile_zoom
+        self.enabled = enabled
+
+    def configure(self, precision, bucket_seconds, window_buckets, tile_zoom, enabled=True):
+        self.precision = precision
+        self.bucket_seconds = bucket_seconds
+        self.window_buckets = window_buckets
+        self.tile_zoom = tile_zoom
+        self.enabled = enabled
+
+    def bucket(self, at):
+        # Naive datetimes are UTC here (utcnow(), BSON dates); at.timestamp() would read them as local time
+        seconds = calendar.timegm(at.utctimetuple()) // self.bucket_seconds * self.bucket_seconds
+        return EPOCH + timedelta(seconds=seconds)
+
+    def increment(self, cell, bucket, n=1):
+        """(filter, update) adding n requests to one cell's bucket."""
+        return (
+            {"_id": f"{cell}:{bucket:%Y%m%d%H%M}"},
+            {
+                "$inc": {"count": n},
+                "$setOnInsert": {
+                    "cell": cell,
+                    "bucket": bucket,
+                    # The TTL monitor drops it once the bucket has left the window
+                    "expires_at": bucket + timedelta(seconds=self.bucket_seconds * (self.window_buckets + 1)),
+                },
+            },
+        )
+
+    def record(self, point, at=None):
+        """Count one ride request at (lat, lng); a failed write is logged and never fails the request."""
+        self.record_many([point], at)
+
+    def record_many(self, points, at=None):
+        if not self.enabled:
+            return
+        bucket = self.bucket(at or datetime.utcnow())
+        cells = {}
+        for point in points:
+            if point:
+                cell = geohash(*point, self.precision)
+                cells[cell] = cells.get(cell, 0) + 1
+        if not cells:
+            return
+        try:
+            if len(cells) == 1:
+                (cell, n), = cells.items()
+                mongo.db.demand_cells.update_one(*self.increment(cell, bucket, n), upsert=True)
+            else:
+                mongo.db.demand_cells.bulk_write(
+                    [UpdateOne(*self.increment(cell, bucket, n), upsert=True) for cell, n in cells.items()],
+                    ordered=False,
+                )
+        except PyMongoError as exc:
+            log.warning("could not record demand for %d cells: %s", len(cells), exc)
+
+    def tile(self, z, x, y, now=None):
+        """{"cells": [[geohash, count], ...]} for one map tile, summed over the rolling window."""
+        cells = geohashes_in_bbox(*tile_bounds(z, x, y), self.precision)
+        since = self.bucket(now or datetime.utcnow()) - timedelta(seconds=self.bucket_seconds * (self.window_buckets - 1))
+        counts = {}
+        for doc in mongo.db.demand_cells.find({"cell": {"$in": cells}, "bucket": {"$gte": since}},
+                                              {"_id": 0, "cell": 1, "count": 1}):
+            counts[doc["cell"]] = counts.get(doc["cell"], 0) + doc["count"]
+        return {
+            "precision": self.precision,
+            "window_minutes": self.bucket_seconds * self.window_buckets // 60,
+            "cells": sorted(counts.items()),
+        }
+
+
+demand_heatmap = DemandHeatmap()
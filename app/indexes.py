@@ -0,0 +1,150 @@
+import logging
+from datetime import datetime
+
+import click
+from bson import ObjectId
+from pymongo import ASCENDING, DESCENDING, GEOSPHERE
+from pymongo.errors import OperationFailure
+
+from .geo import to_point
+
+log = logging.getLogger(__name__)
+
+
+# -------------------- DECLARED INDEXES --------------------
+# collection -> list of (keys, options). Names are explicit so reruns are no-ops.
+INDEXES = {
+    "users": [
+        ([("email", ASCENDING)], {"name": "email_unique", "unique": True}),
+    ],
+    "rides": [
+        # (field, _id) so keyset pages are a bounded range scan with no in-memory sort
+        ([("status", ASCENDING), ("_id", ASCENDING)], {"name": "status_id"}),
+        ([("rider_id", ASCENDING), ("_id", DESCENDING)], {"name": "rider_id_id"}),
+        ([("driver_id", ASCENDING), ("status", ASCENDING)], {"name": "driver_id_status"}),
+        ([("updated_at", ASCENDING)], {"name": "updated_at"}),
+    ],
+    "drivers": [
+        ([("user_id", ASCENDING)], {"name": "user_id_unique", "unique": True}),
+        ([("availability", ASCENDING)], {"name": "availability"}),
+        ([("location", GEOSPHERE)], {"name": "location_2dsphere"}),
+    ],
+    "trips": [
+        ([("ride_request_id", ASCENDING)], {"name": "ride_request_id"}),
+        ([("start_time", ASCENDING)], {"name": "start_time"}),
+        ([("updated_at", ASCENDING)], {"name": "updated_at"}),
+    ],
+    "ride_events": [
+        ([("ride_id", ASCENDING), ("at", ASCENDING)], {"name": "ride_id_at"}),
+        ([("at", ASCENDING)], {"name": "at"}),
+    ],
+    "daily_stats": [
+        ([("driver_id", ASCENDING), ("day", ASCENDING)], {"name": "driver_id_day"}),
+        ([("day", ASCENDING)], {"name": "day"}),
+    ],
+    "demand_cells": [
+        ([("cell", ASCENDING), ("bucket", ASCENDING)], {"name": "cell_bucket"}),
+        # TTL: buckets that have left the heatmap window are removed by the server
+        ([("expires_at", ASCENDING)], {"name": "expires_at_ttl", "expireAfterSeconds": 0}),
+    ],
+}
+
+
+def ensure_indexes(db):
+    """Create every declared index. Safe to call on each startup.
+
+    An index that can't be built (e.g. a unique index over existing duplicates)
+    is logged and skipped so the app still starts.
+    """
+    failed = []
+    for collection, indexes in INDEXES.items():
+        for keys, options in indexes:
+            try:
+                db[collection].create_index(keys, **options)
+            except OperationFailure as exc:
+                log.error("could not create index %s.%s: %s", collection, options["name"], exc)
+                failed.append(f"{collection}.{options['name']}")
+    return failed
+
+
+# -------------------- QUERY PLAN AUDIT --------------------
+# One representative of every query shape the models and routes issue
+_SAMPLE_ID = ObjectId()
+AUDITED_QUERIES = [
+    ("users by email", "users", {"email": "audit@example.com"}, None),
+    ("pending rides", "rides", {"status": "pending"}, [("_id", ASCENDING)]),
+    ("rides by rider", "rides", {"rider_id": str(_SAMPLE_ID)}, [("_id", DESCENDING)]),
+    ("rides by rider p2", "rides", {"rider_id": str(_SAMPLE_ID), "_id": {"$lt": _SAMPLE_ID}}, [("_id", DESCENDING)]),
+    ("busy drivers", "rides", {"driver_id": str(_SAMPLE_ID), "status": {"$in": ["accepted", "in_progress"]}}, None),
+    ("driver by user", "drivers", {"user_id": str(_SAMPLE_ID)}, None),
+    ("available drivers", "drivers", {"availability": True}, None),
+    ("nearest drivers", "drivers", {
+        "availability": True,
+        "location": {"$nearSphere": {"$geometry": to_point(-1.2921, 36.8219), "$maxDistance": 10_000}},
+    }, None),
+    ("trip by ride", "trips", {"ride_request_id": str(_SAMPLE_ID)}, None),
+    ("rides changed since", "rides", {"updated_at": {"$gt": datetime(2024, 1, 1)}}, None),
+    ("trips changed since", "trips", {"updated_at": {"$gt": datetime(2024, 1, 1)}}, None),
+    ("trips by day", "trips", {"start_time": {"$gte": datetime(2024, 1, 1), "$lt": datetime(2024, 1, 2)}}, None),
+    ("events of a ride", "ride_events", {"ride_id": str(_SAMPLE_ID)}, [("at", ASCENDING)]),
+    ("events since", "ride_events", {"at": {"$gte": datetime(2024, 1, 1)}}, [("at", ASCENDING)]),
+    ("daily stats", "daily_stats", {"day": {"$gte": "2024-01-01", "$lte": "2024-01-31"}, "driver_id": None},
+     [("day", ASCENDING)]),
+    ("demand tile", "demand_cells", {"cell": {"$in": ["kzf0tu", "kzf0tv"]}, "bucket": {"$gte": datetime(2024, 1, 1)}}, None),
+]
+
+
+def _stages(plan):
+    yield plan.get("stage")
+    for key in ("inputStage", "queryPlan"):
+        if key in plan:
+            yield from _stages(plan[key])
+    for child in plan.get("inputStages", []):
+        yield from _stages(child)
+
+
+def audit_query_plans(db):
+    """Explain each audited query. Returns [(name, collection, stages, ok)]."""
+    report = []
+    for name, collection, query, sort in AUDITED_QUERIES:
+        cursor = db[collection].find(query)
+        if sort:
+            cursor = cursor.sort(sort)
+        plan = cursor.explain()["queryPlanner"]["winningPlan"]
+        stages = [s for s in _stages(plan) if s]
+        report.append((name, collection, stages, "COLLSCAN" not in stages))
+    return report
+
+
+# -------------------- CLI --------------------
+def register_commands(app, mongo):
+    @app.cli.command("ensure-indexes")
+    def ensure_indexes_command():
+        """Create all declared MongoDB indexes."""
+        failed = ensure_indexes(mongo.db)
+        if failed:
+            raise click.ClickException(f"failed to create: {', '.join(failed)}")
+        click.echo("indexes ok")
+
+    @app.cli.command("dedupe-drivers")
+    def dedupe_drivers_command():
+        """Keep only the newest driver document per user_id (needed before the unique index)."""
+        removed = 0
+        duplicates = mongo.db.drivers.aggregate([
+            {"$group": {"_id": "$user_id", "ids": {"$push": "$_id"}, "count": {"$sum": 1}}},
+            {"$match": {"count": {"$gt": 1}}},
+        ])
+        for group in duplicates:
+            stale = sorted(group["ids"])[:-1]
+            removed += mongo.db.drivers.delete_many({"_id": {"$in": stale}}).deleted_count
+        click.echo(f"removed {removed} duplicate driver documents")
+
+    @app.cli.command("audit-indexes")
+    def audit_indexes_command():
+        """Explain every model query and fail if any plan is a COLLSCAN."""
+        scans = 0
+        for name, collection, stages, ok in audit_query_plans(mongo.db):
+            click.echo(f"{'ok  ' if ok else 'SCAN'} {collection:<8} {name:<18} {' > '.join(stages)}")
+            scans += not ok
+        if scans:
+            raise click.ClickException(f"{scans} queries fall back to a collection scan")
@@ -0,0 +1,117 @@
+import atexit
+import logging
+import threading
+
+from pymongo import UpdateOne
+from pymongo.errors import PyMongoError
+
+log = logging.getLogger(__name__)
+
+
+# -------------------- LOCATION BUFFER --------------------
+class LocationBuffer:
+    """Coalesces driver GPS pings in memory and writes them as one unordered bulk_write.
+
+    Only the latest ping per driver is kept (last write wins). The buffer holds
+    at most `max_pending` drivers; once it is full, pings from drivers not
+    already buffered are rejected so callers can push back (HTTP 503). A flush
+    runs every `flush_interval_ms` or as soon as `flush_batch` drivers are waiting.
+    """
+
+    def __init__(self, max_pending=10_000, flush_interval_ms=500, flush_batch=1_000):
+        self.max_pending = max_pending
+        self.flush_interval_ms = flush_interval_ms
+        self.flush_batch = flush_batch
+        self.counters = {"accepted": 0, "coalesced": 0, "dropped": 0, "flushed": 0, "flushes": 0, "errors": 0}
+        self._pending = {}  # user_id -> (filter, update)
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._collection = None
+
+    def __len__(self):
+        return len(self._pending)
+
+    def submit(self, user_id, query, update):
+        """Buffer one ping. Returns False if it was dropped because the buffer is full."""
+        with self._lock:
+            if user_id in self._pending:
+                self.counters["coalesced"] += 1
+            elif len(self._pending) >= self.max_pending:
+                self.counters["dropped"] += 1
+                self._wake.set()
+                return False
+            self._pending[user_id] = (query, update)
+            self.counters["accepted"] += 1
+            if len(self._pending) >= self.flush_batch:
+                self._wake.set()
+        return True
+
+    def flush(self):
+        """Write everything buffered so far. Returns the number of drivers written."""
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, {}
+            if not batch:
+                return 0
+            ops = [UpdateOne(query, update, upsert=True) for query, update in batch.values()]
+            try:
+                self._collection.bulk_write(ops, ordered=False)
+            except PyMongoError:
+                log.exception("location flush of %d drivers failed", len(batch))
+                with self._lock:
+                    self.counters["errors"] += 1
+                    # Put back what hasn't been superseded by a newer ping, within capacity
+                    for user_id, op in batch.items():
+                        if user_id not in self._pending and len(self._pending) < self.max_pending:
+                            self._pending[user_id] = op
+                        elif user_id not in self._pending:
+                            self.counters["dropped"] += 1
+                return 0
+            with self._lock:
+                self.counters["flushed"] += len(batch)
+                self.counters["flushes"] += 1
+            return len(batch)
+
+    def start(self, collection):
+        """Start the background flusher; pending pings are flushed again at interpreter exit."""
+        self._collection = collection
+        if self._thread and self._thread.is_alive():
+            return self._thread
+        self._stop.clear()
+
+        def run():
+            while not self._stop.is_set():
+                self._wake.wait(self.flush_interval_ms / 1000)
+                self._wake.clear()
+                try:
+                    self.flush()
+                except Exception:
+                    # Anything flush() doesn't handle (e.g. a document BSON can't encode)
+                    # costs that batch, never the flusher
+                    log.exception("location flush failed")
+                    with self._lock:
+                        self.counters["errors"] += 1
+
+        self._thread = threading.Thread(target=run, name="location-flusher", daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+        return self._thread
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+        if self._collection is not None:
+            self.flush()
+
+    def stats(self):
+        with self._lock:
+            return {**self.counters, "pending": len(self._pending), "max_pending": self.max_pending,
+                    "flusher_alive": bool(self._thread and self._thread.is_alive())}
+
+
+location_buffer = LocationBuffer()
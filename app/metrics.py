@@ -0,0 +1,170 @@
+import logging
+import threading
+import time
+from bisect import bisect_left
+
+import bson
+from flask import g, has_request_context
+from pymongo import monitoring
+
+log = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COMMAND_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 50, 100)
+
+
+# -------------------- HISTOGRAM --------------------
+class Histogram:
+    """Fixed-bucket histogram in the Prometheus style (cumulative counts when rendered)."""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        total = 0
+        for bound, n in zip((*self.buckets, "+Inf"), self.counts):
+            total += n
+            yield bound, total
+
+
+# -------------------- MONGO COMMAND LISTENER --------------------
+def command_collection(event):
+    value = event.command.get("collection" if event.command_name == "getMore" else event.command_name)
+    return value if isinstance(value, str) else "-"
+
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """Counts commands and server time per collection and per request (reply bytes too, if enabled).
+
+    PyMongo publishes command events on the thread that issued the command,
+    so inside a request they are attributed to that request via flask.g.
+    Sizing a reply means re-encoding it, so `reply_bytes` is off by default.
+    """
+
+    def __init__(self, reply_bytes=False):
+        self.reply_bytes = reply_bytes
+        self._lock = threading.Lock()
+        self._inflight = {}  # (connection, request_id) -> collection
+        self.totals = {}  # (collection, command) -> [count, seconds, reply_bytes, failures]
+
+    def started(self, event):
+        with self._lock:
+            self._inflight[(event.connection_id, event.request_id)] = command_collection(event)
+
+    def succeeded(self, event):
+        self._finish(event, len(bson.encode(event.reply)) if self.reply_bytes else 0, failed=False)
+
+    def failed(self, event):
+        self._finish(event, 0, failed=True)
+
+    def _finish(self, event, reply_bytes, failed):
+        seconds = event.duration_micros / 1e6
+        with self._lock:
+            collection = self._inflight.pop((event.connection_id, event.request_id), "-")
+            row = self.totals.setdefault((collection, event.command_name), [0, 0.0, 0, 0])
+            row[0] += 1
+            row[1] += seconds
+            row[2] += reply_bytes
+            row[3] += failed
+        if has_request_context() and "mongo_ops" in g:
+            g.mongo_ops.append((collection, event.command_name, seconds, reply_bytes))
+
+
+mongo_metrics = MongoCommandMetrics()
+
+
+# -------------------- REQUEST METRICS --------------------
+class RequestMetrics:
+    """Per-route latency and Mongo-usage histograms, fed by blueprint before_request/teardown_request hooks."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latency = {}  # (endpoint, method, status) -> Histogram of seconds
+        self.commands = {}  # endpoint -> Histogram of Mongo commands per request
+        self.mongo_seconds = {}  # endpoint -> total Mongo time
+        self.mongo_bytes = {}  # endpoint -> total reply bytes
+
+    def start(self):
+        g.request_started = time.perf_counter()
+        g.mongo_ops = []
+
+    def finish(self, endpoint, method, status, slow_ms=0):
+        if "request_started" not in g:
+            return
+        elapsed = time.perf_counter() - g.request_started
+        ops = g.mongo_ops
+        endpoint = endpoint or "unmatched"
+        with self._lock:
+            key = (endpoint, method, status)
+            self.latency.setdefault(key, Histogram(LATENCY_BUCKETS)).observe(elapsed)
+            self.commands.setdefault(endpoint, Histogram(COMMAND_BUCKETS)).observe(len(ops))
+            self.mongo_seconds[endpoint] = self.mongo_seconds.get(endpoint, 0.0) + sum(op[2] for op in ops)
+            self.mongo_bytes[endpoint] = self.mongo_bytes.get(endpoint, 0) + sum(op[3] for op in ops)
+        if slow_ms and elapsed * 1000 >= slow_ms:
+            queries = ", ".join(f"{coll}.{cmd} {secs * 1000:.1f}ms" + (f" {size}B" if mongo_metrics.reply_bytes else "")
+                                for coll, cmd, secs, size in ops)
+            log.warning("slow request %s %s: %.1f ms, %d mongo commands [%s]",
+                        method, endpoint, elapsed * 1000, len(ops), queries)
+
+
+request_metrics = RequestMetrics()
+
+
+# -------------------- PROMETHEUS TEXT FORMAT --------------------
+def _labels(**labels):
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels.items()) + "}"
+
+
+def _histogram_lines(name, hist, **labels):
+    for bound, total in hist.cumulative():
+        yield f"{name}_bucket{_labels(**labels, le=bound)} {total}"
+    yield f"{name}_sum{_labels(**labels)} {hist.sum:.6f}"
+    yield f"{name}_count{_labels(**labels)} {hist.count}"
+
+
+def _gauges(prefix, stats):
+    for key, value in stats.items():
+        if isinstance(value, (bool, int, float)):
+            yield f"{prefix}_{key} {float(value)}"
+
+
+def render_prometheus(extra=None):
+    """Everything as Prometheus exposition text. `extra` maps metric prefixes to stats dicts (exported as gauges)."""
+    lines = ["# TYPE http_request_duration_seconds histogram"]
+    with request_metrics._lock:
+        for (endpoint, method, status), hist in sorted(request_metrics.latency.items()):
+            lines += _histogram_lines("http_request_duration_seconds", hist,
+                                      endpoint=endpoint, method=method, status=status)
+        lines.append("# TYPE http_request_mongo_commands histogram")
+        for endpoint, hist in sorted(request_metrics.commands.items()):
+            lines += _histogram_lines("http_request_mongo_commands", hist, endpoint=endpoint)
+        lines.append("# TYPE http_request_mongo_seconds_total counter")
+        for endpoint, seconds in sorted(request_metrics.mongo_seconds.items()):
+            lines.append(f"http_request_mongo_seconds_total{_labels(endpoint=endpoint)} {seconds:.6f}")
+        if mongo_metrics.reply_bytes:
+            lines.append("# TYPE http_request_mongo_reply_bytes_total counter")
+            for endpoint, size in sorted(request_metrics.mongo_bytes.items()):
+                lines.append(f"http_request_mongo_reply_bytes_total{_labels(endpoint=endpoint)} {size}")
+
+    with mongo_metrics._lock:
+        totals = sorted(mongo_metrics.totals.items())
+    for name, index, kind in (("mongo_commands_total", 0, "counter"), ("mongo_command_seconds_total", 1, "counter"),
+                              ("mongo_reply_bytes_total", 2, "counter"), ("mongo_command_failures_total", 3, "counter")):
+        if index == 2 and not mongo_metrics.reply_bytes:
+            continue
+        lines.append(f"# TYPE {name} {kind}")
+        for (collection, command), row in totals:
+            value = f"{row[index]:.6f}" if isinstance(row[index], float) else row[index]
+            lines.append(f"{name}{_labels(collection=collection, command=command)} {value}")
+
+    for prefix, stats in (extra or {}).items():
+        lines += _gauges(prefix, stats)
+    return "\n".join(lines) + "\n"
@@ -1,14 +1,207 @@
 # app/models.py
+
 from bson import ObjectId
+from flask import g, has_app_context
 from flask_login import UserMixin
-from werkzeug.security import generate_password_hash, check_password_hash
+from pymongo import ASCENDING, DESCENDING, ReturnDocument, UpdateOne
 from datetime import datetime
 from . import mongo
+from .geo import estimate_eta, eta_stages, from_point, parse_latlng, to_point
+from .spatial import driver_grid
+from .cache import user_cache
+from .pagination import keyset_page
+from .places import gazetteer
+from .passwords import password_hasher
+from .pricing import pricing
+from .heatmap import demand_heatmap
+from .ride_log import ride_log, log_entry, status_entry
+from .bulk import BulkResult, bulk_write_items, mark_failed, save_models, update_by_ids
+
+# Only the fields the ride list templates render
+RIDER_RIDE_FIELDS = {"pickup": 1, "pickup_location": 1, "destination": 1, "status": 1, "eta": 1, "match_code": 1,
+                     "fare_estimate": 1}
+PENDING_RIDE_FIELDS = {"pickup": 1, "destination": 1, "status": 1, "driver_id": 1}
+DRIVER_LIST_FIELDS = {"user_id": 1, "current_location": 1, "vehicle_details": 1}
+
+
+
+def resolve_point(text):
+    place = gazetteer.geocode(text)
+    return to_point(place.lat, place.lng) if place else None
+
+
+# -------------------- DOCUMENT CODEC + CHANGE TRACKING --------------------
+class Tracked:
+    """Base for the models: one from_doc/to_doc codec per class, driven by FIELDS, plus change tracking.
+
+    FIELDS maps each stored field to the default used when a document lacks it;
+    subclasses list them again in __slots__ so a loaded model carries no
+    per-instance dict. A model loaded with a projection only hydrates (and
+    only ever saves) the projected fields.
+
+    Saves $set only what differs from the document as last loaded or saved.
+    Fields listed in UNTRACKED (e.g. timestamps stamped on every write) never
+    make a model dirty on their own.
+    """
+
+    __slots__ = ("id", "_clean", "_fields")
+    FIELDS = {}
+    UNTRACKED = ()
+
+    @classmethod
+    def from_doc(cls, data, fields=None):
+        """Build a clean model from a Mongo document (without running __init__). `fields` is the projection used.
+
+        The model keeps no reference to `data` beyond the field values it loaded.
+        """
+        model = cls.__new__(cls)
+        model.id = str(data["_id"]) if data.get("_id") else None
+        for name, default in cls.FIELDS.items():
+            object.__setattr__(model, name, data.get(name, default))
+        model._fields = projected(fields)
+        model.mark_clean()
+        return model
+
+    def to_doc(self):
+        fields = getattr(self, "_fields", None)
+        return {name: getattr(self, name) for name in self.FIELDS if fields is None or name in fields}
+
+    def as_dict(self):
+        """JSON-friendly view: the loaded fields plus _id."""
+        fields = getattr(self, "_fields", None)
+        return {"_id": self.id, **{name: getattr(self, name) for name in self.FIELDS if fields is None or name in fields}}
+
+    def stamped(self, changes, doc):
+        """`changes` plus the UNTRACKED stamps from `doc`, which go out with every write."""
+        return {**changes, **{name: doc[name] for name in self.UNTRACKED if name in doc}}
+
+    def tracked_names(self):
+        """The loaded fields that changes() compares, in FIELDS order (cached per class and projection)."""
+        key = (type(self), getattr(self, "_fields", None))
+        names = _tracked_names.get(key)
+        if names is None:
+            names = _tracked_names[key] = tuple(
+                name for name in self.FIELDS
+                if name not in self.UNTRACKED and (key[1] is None or name in key[1])
+            )
+        return names
+
+    def mark_clean(self, doc=None):
+        """Snapshot the tracked fields as stored: the current values, or those of `doc` just written.
+
+        A field `doc` lacks is clean at its FIELDS default.
+        """
+        if doc is None:
+            self._clean = tuple(fingerprint(getattr(self, name)) for name in self.tracked_names())
+        else:
+            self._clean = tuple(fingerprint(doc.get(name, self.FIELDS[name])) for name in self.tracked_names())
+
+    def changes(self):
+        """Tracked fields of to_doc() that differ from the clean snapshot (everything if never loaded/saved).
+
+        Derived keys to_doc() adds are the subclass's to report (see Driver).
+        """
+        doc = self.to_doc()
+        clean = getattr(self, "_clean", None)
+        if clean is None:
+            return {k: v for k, v in doc.items() if k not in self.UNTRACKED}
+        return {
+            name: doc[name] for name, stored in zip(self.tracked_names(), clean)
+            if fingerprint(doc[name]) != stored
+        }
+
+
+_tracked_names = {}
+_DIGEST = object()
+
+
+def fingerprint(value):
+    """What a clean snapshot keeps of a field: the value itself, or a digest of a dict/list.
+
+    Scalars are immutable, so sharing them costs nothing; nested values are
+    never aliased, so an in-place edit (even of a shared driver_grid payload)
+    still reads as a change.
+    """
+    if isinstance(value, (dict, list)):
+        return (_DIGEST, hash(frozen(value)))
+    return value
+
+
+def frozen(value):
+    """Hashable copy of a dict/list tree (dict key order ignored)."""
+    if isinstance(value, dict):
+        return tuple(sorted((k, frozen(v)) for k, v in value.items()))
+    if isinstance(value, list):
+        return tuple(frozen(v) for v in value)
+    return value
 
 
+def projected(fields):
+    """Field names of a projection ({"a": 1, ...} or a list of names); None means every field."""
+    if not fields or isinstance(fields, frozenset):
+        return fields or None
+    if isinstance(fields, dict):
+        return frozenset(name for name, keep in fields.items() if keep and name != "_id")
+    return frozenset(name for name in fields if name != "_id")
+
+
+def identity_map():
+    """This request's {(collection, id): model}, so a document is only loaded once per request."""
+    if not has_app_context():
+        return {}
+    if "identity_map" not in g:
+        g.identity_map = {}
+    return g.identity_map
+
+
+def load_one(cls, collection, query, fields=None):
+    """find_one through the identity map; returns the model already loaded this request if there is one.
+
+    Projected (partial) loads bypass the map.
+    """
+    if fields:
+        data = collection.find_one(query, fields)
+        return cls.from_doc(data, fields) if data else None
+    imap = identity_map()
+    key = (collection.name, str(query["_id"])) if set(query) == {"_id"} else None
+    if key in imap:
+        return imap[key]
+    data = collection.find_one(query)
+    return remember(cls, collection.name, data) if data else None
+
+
+def load_many(cls, docs, fields=None):
+    fields = projected(fields)  # one shared set for the whole list
+    return [cls.from_doc(doc, fields) for doc in docs]
+
+
+def forget(collection_name, ids):
+    """Drop models from this request's identity map after a write that bypassed them."""
+    imap = identity_map()
+    for i in ids:
+        imap.pop((collection_name, str(i)), None)
+
+
+def remember(cls, collection_name, data):
+    imap = identity_map()
+    key = (collection_name, str(data["_id"]))
+    if key not in imap:
+        imap[key] = cls.from_doc(data)
+    return imap[key]
+
 
 # -------------------- USER MODEL --------------------
-class User(UserMixin):
+def forget_user(user_id):
+    """Drop a user from the user cache. Sync and async models are cached under their own keys, never shared."""
+    user_cache.invalidate(user_id)
+    user_cache.invalidate(("async", user_id))
+
+
+class User(Tracked, UserMixin):
+    # UserMixin has no __slots__, so users still get a __dict__; there are never many in memory
+    FIELDS = {"name": None, "email": None, "phone": None, "password_hash": None, "role": "customer"}
+    __slots__ = tuple(FIELDS)
+
     def __init__(self, name, email, phone, password=None, password_hash=None, role="customer", _id=None):
         self.id = str(_id) if _id else None
         self.name = name
@@ -19,112 +212,461 @@ class User(UserMixin):
         if password_hash:
             self.password_hash = password_hash
         elif password:
-            self.password_hash = generate_password_hash(password)
+            self.password_hash = password_hasher.hash(password)
         else:
             self.password_hash = None
         self.role = role  # "customer", "rider", "driver"
 
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = password_hasher.hash(password)
 
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        return password_hasher.verify(self.password_hash, password)
+
+    def rehash_password_if_needed(self, password):
+        """After a successful login, upgrade a hash made under an older method/cost policy."""
+        if not self.id or not password_hasher.needs_rehash(self.password_hash):
+            return False
+        self.password_hash = password_hasher.hash(password)
+        return self.save_to_db()
 
     def save_to_db(self):
-        user_data = {
-            "name": self.name,
-            "email": self.email,
-            "phone": self.phone,
-            "password_hash": self.password_hash,
-            "role": self.role,
-        }
+        """Insert, or $set just the changed fields. Returns False when there was nothing to write."""
+        user_data = self.to_doc()
         if self.id:
-            mongo.db.users.update_one({"_id": ObjectId(self.id)}, {"$set": user_data})
+            changes = self.changes()
+            if not changes:
+                return False
+            mongo.db.users.update_one({"_id": ObjectId(self.id)}, {"$set": changes})
+            # Profile/role changed: drop the cached copies so the next request reloads it
+            forget_user(self.id)
         else:
             result = mongo.db.users.insert_one(user_data)
             self.id = str(result.inserted_id)
+        self.mark_clean(user_data)
+        return True
+
+    @staticmethod
+    def get_by_id(user_id):
+        """Load a user by id, served from the TTL/LRU user cache when possible."""
+        imap = identity_map()
+        user = imap.get(("users", user_id)) or user_cache.get(user_id)
+        if user is not None:
+            imap[("users", user_id)] = user
+            return user
+        if not ObjectId.is_valid(user_id):
+            return None
+        user = load_one(User, mongo.db.users, {"_id": ObjectId(user_id)})
+        if user is not None:
+            user_cache.set(user_id, user)
+        return user
 
     @staticmethod
     def get_by_email(email):
         data = mongo.db.users.find_one({"email": email})
-        if data:
-            return User(
-                name=data["name"],
-                email=data["email"],
-                phone=data["phone"],
-                password_hash=data["password_hash"],  # <- keep original hash
-                role=data.get("role", "customer"),
-                _id=data["_id"],
-            )
-        return None
+        return remember(User, "users", data) if data else None
 
 
 # -------------------- RIDE REQUEST MODEL --------------------
-class RideRequest:
+class RideRequest(Tracked):
+    FIELDS = {
+        "pickup": None, "destination": None, "rider_id": None,
+        "status": "pending",  # pending, accepted, in_progress, completed
+        "driver_id": None,
+        "pickup_location": None, "destination_location": None,
+        # Set when a driver accepts
+        "eta": None, "match_code": None, "accepted_at": None,
+        # Quoted when the ride is requested
+        "fare_estimate": None, "surge": None,
+        # Stamped on every write; reporting jobs pick up changes after a watermark
+        "updated_at": None,
+    }
+    __slots__ = tuple(FIELDS)
+    UNTRACKED = ("updated_at",)
+
     def __init__(self, pickup, destination, rider_id, status="pending", driver_id=None, _id=None):
         self.id = str(_id) if _id else None
+        for name, default in self.FIELDS.items():
+            setattr(self, name, default)
         self.pickup = pickup
         self.destination = destination
         self.rider_id = rider_id
-        self.status = status  # pending, accepted, in_progress, completed
+        self.status = status
         self.driver_id = driver_id
 
+    # Labels whose resolved coordinates are kept next to them, so ETA/dispatch never guess from free text
+    GEOCODED = {"pickup": "pickup_location", "destination": "destination_location"}
+
+    def __setattr__(self, name, value):
+        # Geocode once, when a label is assigned or changed; a location set after it wins.
+        # from_doc() hydrates around this, so stored coordinates are kept as they are.
+        location = self.GEOCODED.get(name)
+        if location and getattr(self, name, None) != value:
+            object.__setattr__(self, location, resolve_point(value))
+        object.__setattr__(self, name, value)
+
+    def to_doc(self):
+        doc = super().to_doc()
+        doc["updated_at"] = datetime.utcnow()
+        return doc
+
+    def latlng(self, field):
+        """(lat, lng) of "pickup" or "destination": the resolved point, else the text itself."""
+        return from_point(getattr(self, f"{field}_location")) or parse_latlng(getattr(self, field))
+
+    def quote_fare(self):
+        """Price the trip (see app.pricing) and keep the quote on the ride. Returns the Quote, or None."""
+        quote = pricing.quote(self.latlng("pickup"), self.latlng("destination"))
+        if quote:
+            self.fare_estimate, self.surge = quote.fare, quote.surge
+        return quote
+
     def save_to_db(self):
-        ride_data = {
-            "pickup": self.pickup,
-            "destination": self.destination,
-            "rider_id": self.rider_id,
-            "status": self.status,
-            "driver_id": self.driver_id,
-        }
+        """Insert, or $set just the changed fields. Returns False when there was nothing to write."""
+        ride_data = self.to_doc()
         if self.id:
-            mongo.db.rides.update_one({"_id": self.id}, {"$set": ride_data})
+            changes = self.changes()
+            if not changes:
+                return False
+            mongo.db.rides.update_one({"_id": ObjectId(self.id)}, {"$set": self.stamped(changes, ride_data)})
+            if "status" in changes:
+                ride_log.record([status_entry(self.id, self.status, ride_data["updated_at"], driver_id=self.driver_id)])
         else:
             result = mongo.db.rides.insert_one(ride_data)
             self.id = str(result.inserted_id)
+            demand_heatmap.record(from_point(ride_data.get("pickup_location")) or parse_latlng(self.pickup))
+            ride_log.record([log_entry(self.id, "created", ride_data["updated_at"], rider_id=self.rider_id)])
+        self.updated_at = ride_data["updated_at"]
+        self.mark_clean(ride_data)
+        return True
+
+    @staticmethod
+    def get_by_id(ride_id, fields=None):
+        if not ObjectId.is_valid(ride_id):
+            return None
+        return load_one(RideRequest, mongo.db.rides, {"_id": ObjectId(ride_id)}, fields)
 
     @staticmethod
     def get_pending_rides():
         return list(mongo.db.rides.find({"status": "pending"}))
 
+    @staticmethod
+    def for_rider(rider_id, after=None, limit=20, fields=RIDER_RIDE_FIELDS):
+        """A rider's rides, newest first, one keyset page at a time. Returns (rides, next_cursor)."""
+        docs, next_cursor = keyset_page(mongo.db.rides, {"rider_id": rider_id}, fields,
+                                        after=after, limit=limit, direction=DESCENDING)
+        return load_many(RideRequest, docs, fields), next_cursor
+
+    @staticmethod
+    def claim(ride_id, driver_id, driver_at=None, **fields):
+        """Atomically move a pending ride to accepted for this driver.
+
+        With `driver_at` (lat, lng) the same write also fills in the ETA to the pickup
+        (a second one for older rides whose pickup is only text, see backfill_pickup).
+        Returns the updated ride, or None if the ride doesn't exist or is no longer pending.
+        """
+        query, update = RideRequest.claim_update(ride_id, driver_id, driver_at, **fields)
+        forget("rides", [ride_id])
+        ride = mongo.db.rides.find_one_and_update(query, update, return_document=ReturnDocument.AFTER)
+        if ride:
+            backfill = RideRequest.backfill_pickup(ride, driver_at)
+            if backfill:
+                mongo.db.rides.update_one(*backfill)
+            ride_log.record([log_entry(ride_id, "accepted", ride["accepted_at"], driver_id=driver_id)])
+        return ride
+
+    @staticmethod
+    def claim_update(ride_id, driver_id, driver_at=None, now=None, **fields):
+        """(filter, update) that accepts a ride only while it is still pending.
+
+        Given the driver's (lat, lng), the update is a pipeline that also sets
+        eta/eta_km/eta_seconds from the stored pickup point.
+        """
+        now = now or datetime.utcnow()
+        changes = {"status": "accepted", "driver_id": driver_id, "accepted_at": now, "updated_at": now, **fields}
+        query = {"_id": ObjectId(ride_id), "status": "pending"}
+        if driver_at is None:
+            return query, {"$set": changes}
+        literal = {name: {"$literal": value} for name, value in changes.items()}
+        return query, [{"$set": literal}, *eta_stages("pickup_location", *driver_at)]
+
+    @staticmethod
+    def backfill_pickup(ride, driver_at):
+        """(filter, update) completing a just-claimed ride that has no pickup point, or None.
+
+        Older rides only carry their pickup as "lat,lng" text, which the claim
+        pipeline can't measure from. This stores the parsed point (so the next
+        claim computes the ETA itself) and the ETA, and applies both to `ride`.
+        """
+        if driver_at is None or ride.get("pickup_location"):
+            return None
+        pickup = parse_latlng(ride.get("pickup"))
+        if not pickup:
+            return None
+        eta = estimate_eta(pickup, driver_at)
+        changes = {
+            "pickup_location": to_point(*pickup),
+            "eta_km": round(eta.km, 3), "eta_seconds": int(eta.seconds), "eta": f"{int(eta.seconds // 60)} min",
+        }
+        ride.update(changes)
+        return {"_id": ride["_id"]}, {"$set": changes}
+
+    # Bulk operations: one round trip for many rides, a BulkResult per item
+    @staticmethod
+    def save_many(rides, ordered=False):
+        rides = list(rides)
+        new = [ride for ride in rides if not ride.id]
+        moved = [ride for ride in rides if ride.id and "status" in ride.changes()]
+        results = save_models(mongo.db.rides, rides, ordered)
+        saved = {result.id for result in results if result.ok}
+        # Points were resolved when the labels were assigned; record what was just stored
+        demand_heatmap.record_many(ride.latlng("pickup") for ride in new if ride.id)
+        ride_log.record(
+            [log_entry(ride.id, "created", rider_id=ride.rider_id) for ride in new if ride.id]
+            + [status_entry(ride.id, ride.status, driver_id=ride.driver_id) for ride in moved if ride.id in saved]
+        )
+        return results
+
+    @staticmethod
+    def bulk_set_status(ride_ids, status, ordered=False, **fields):
+        ride_ids = list(ride_ids)
+        update = {"$set": {"status": status, "updated_at": datetime.utcnow(), **fields}}
+        forget("rides", ride_ids)
+        results = update_by_ids(mongo.db.rides, [(ride_id, update) for ride_id in ride_ids], ordered)
+        ride_log.record(status_entry(result.id, status, update["$set"]["updated_at"], driver_id=fields.get("driver_id"))
+                        for result in results if result.ok)
+        return results
+
+    @staticmethod
+    def bulk_assign(assignments, ordered=False):
+        """Claim many pending rides at once: [(ride_id, driver_id[, fields])]. Returns a BulkResult per item.
+
+        Like claim(), only a ride that is still pending is written. Every other
+        item comes back not ok: "no longer pending" (another driver has it),
+        "already accepted" (this driver had it before this call), "duplicate in
+        batch" (a repeat of an earlier item), or "invalid id".
+        """
+        now = datetime.utcnow()
+        now = now.replace(microsecond=now.microsecond // 1000 * 1000)  # as stored: BSON dates keep milliseconds
+        items, ops, drivers = [], [], {}
+        for ride_id, driver_id, *fields in assignments:
+            ride_id = str(ride_id)
+            if not ObjectId.is_valid(ride_id):
+                items.append(BulkResult(ride_id, False, "invalid id"))
+            elif ride_id in drivers:
+                items.append(BulkResult(ride_id, False, "duplicate in batch"))
+            else:
+                drivers[ride_id] = driver_id
+                items.append(None)
+                query, update = RideRequest.claim_update(ride_id, driver_id, now=now, **(fields[0] if fields else {}))
+                ops.append(UpdateOne(query, update))
+        forget("rides", drivers)
+        results, counts = bulk_write_items(mongo.db.rides, list(drivers), ops, ordered)
+        if counts["modified"] < sum(r.ok for r in results):
+            # Some filters didn't match: only rides stamped by this call are ours
+            owner = {
+                str(doc["_id"]): (doc.get("driver_id"), doc.get("accepted_at")) for doc in mongo.db.rides.find(
+                    {"_id": {"$in": [ObjectId(i) for i in drivers]}}, {"driver_id": 1, "accepted_at": 1}
+                )
+            }
+            lost, stale = set(), set()
+            for ride_id, driver_id in drivers.items():
+                holder, accepted_at = owner.get(ride_id, (None, None))
+                if holder != driver_id:
+                    lost.add(ride_id)
+                elif accepted_at != now:
+                    stale.add(ride_id)
+            results = mark_failed(mark_failed(results, lost, "no longer pending"), stale, "already accepted")
+        ride_log.record(log_entry(r.id, "accepted", now, driver_id=drivers[r.id]) for r in results if r.ok)
+        written = iter(results)
+        return [item or next(written) for item in items]
+
 
 # -------------------- DRIVER MODEL --------------------
-class Driver:
+class Driver(Tracked):
+    FIELDS = {
+        "user_id": None, "availability": True,
+        "current_location": None,  # "lat,lng|place" string
+        "vehicle_details": None, "last_seen": None,
+    }
+    __slots__ = tuple(FIELDS)
+    UNTRACKED = ("last_seen",)
+
     def __init__(self, user_id, availability=True, current_location=None, vehicle_details=None, _id=None):
         self.id = str(_id) if _id else None
         self.user_id = user_id
         self.availability = availability
-        self.current_location = current_location  # could be dict {lat, lng}
+        self.current_location = current_location
         self.vehicle_details = vehicle_details or {}
+        self.last_seen = None
+
+    @property
+    def location(self):
+        # GeoJSON point for the 2dsphere index, derived from the "lat,lng|place" string
+        latlng = parse_latlng(self.current_location)
+        return to_point(*latlng) if latlng else None
+
+    def to_doc(self):
+        doc = super().to_doc()
+        if "current_location" in doc:
+            doc["location"] = self.location
+        doc["last_seen"] = datetime.utcnow()
+        return doc
+
+    def changes(self):
+        changes = super().changes()
+        # The GeoJSON point is derived, so it is written exactly when current_location is
+        changes.pop("location", None)
+        if "current_location" in changes:
+            changes["location"] = self.location
+        return changes
 
     def save_to_db(self):
-        driver_data = {
-            "user_id": self.user_id,
-            "availability": self.availability,
-            "current_location": self.current_location,
-            "vehicle_details": self.vehicle_details,
-        }
+        """Upsert this driver's document, writing only changed fields once loaded. Returns False if a no-op."""
+        driver_data = self.to_doc()
         if self.id:
-            mongo.db.drivers.update_one({"_id": self.id}, {"$set": driver_data})
+            changes = self.changes()
+            if not changes:
+                return False
+            changes["last_seen"] = driver_data["last_seen"]
+            mongo.db.drivers.update_one({"_id": ObjectId(self.id)}, {"$set": changes})
         else:
-            result = mongo.db.drivers.insert_one(driver_data)
-            self.id = str(result.inserted_id)
-            
+            # One document per driver: upsert on user_id instead of inserting on every form post
+            result = mongo.db.drivers.update_one({"user_id": self.user_id}, {"$set": driver_data}, upsert=True)
+            if result.upserted_id:
+                self.id = str(result.upserted_id)
+
+        self.last_seen = driver_data["last_seen"]
+        self.mark_clean(driver_data)
+        self.track_saved(driver_data)
+        return True
+
     @staticmethod
-    def get_pending_rides():
-        rides = list(mongo.db.rides.find({"status": "pending"}))
-        for ride in rides:
-            ride["_id"] = str(ride["_id"])
-        return rides
+    def get_by_user_id(user_id):
+        imap = identity_map()
+        if ("drivers", "user", user_id) not in imap:
+            data = mongo.db.drivers.find_one({"user_id": user_id})
+            imap[("drivers", "user", user_id)] = remember(Driver, "drivers", data) if data else None
+        return imap[("drivers", "user", user_id)]
+
+    def track_saved(self, driver_data):
+        # Keep this process's in-memory grid in step with what we just wrote
+        if self.availability and driver_data.get("location"):
+            driver_grid.load([driver_data])
+        else:
+            driver_grid.remove(self.user_id)
+
+    @staticmethod
+    def save_many(drivers, ordered=False):
+        """Upsert many drivers (one document per user_id) in one bulk write. Results are keyed by user_id."""
+        drivers = list(drivers)
+        docs = [driver.to_doc() for driver in drivers]
+        ops = [UpdateOne({"user_id": doc["user_id"]}, {"$set": doc}, upsert=True) for doc in docs]
+        results, counts = bulk_write_items(mongo.db.drivers, [d.user_id for d in drivers], ops, ordered)
+        for n, (driver, doc, result) in enumerate(zip(drivers, docs, results)):
+            if result.ok:
+                if n in counts["upserted_ids"]:
+                    driver.id = str(counts["upserted_ids"][n])
+                driver.mark_clean(doc)
+                driver.track_saved(doc)
+        return results
+
+    @staticmethod
+    def bulk_set_availability(user_ids, available, ordered=False):
+        """Flip availability for many drivers, e.g. at the end of a shift. Results are keyed by user_id."""
+        user_ids = list(user_ids)
+        ops = [UpdateOne({"user_id": user_id}, {"$set": {"availability": available}}) for user_id in user_ids]
+        results, counts = bulk_write_items(mongo.db.drivers, user_ids, ops, ordered)
+        if counts["matched"] < sum(r.ok for r in results):
+            found = set(mongo.db.drivers.distinct("user_id", {"user_id": {"$in": user_ids}}))
+            results = mark_failed(results, set(user_ids) - found, "not found")
+        changed = [r.id for r in results if r.ok]
+        if available:
+            driver_grid.load(mongo.db.drivers.find(
+                {"user_id": {"$in": changed}, "location": {"$ne": None}}, {**DRIVER_LIST_FIELDS, "location": 1}
+            ))
+        else:
+            for user_id in changed:
+                driver_grid.remove(user_id)
+        return results
 
+    @staticmethod
+    def location_update(user_id, lat, lng, label=None, seen_at=None):
+        """(filter, update) for a GPS ping — only the position and last-seen time."""
+        current_location = f"{lat},{lng}|{label}" if label else f"{lat},{lng}"
+        return (
+            {"user_id": user_id},
+            {
+                "$set": {
+                    "current_location": current_location,
+                    "location": to_point(lat, lng),
+                    "last_seen": seen_at or datetime.utcnow(),
+                },
+                "$setOnInsert": {"availability": False, "vehicle_details": {}},
+            },
+        )
 
     @staticmethod
-    def get_available_drivers():
-        return list(mongo.db.drivers.find({"availability": True}))
+    def track_in_grid(user_id, lat, lng, current_location):
+        # Move the driver in the grid if they're available here; unavailable drivers aren't indexed
+        indexed = driver_grid.get(user_id)
+        if indexed:
+            driver_grid.move(user_id, lat, lng, {**indexed[2], "current_location": current_location})
+
+    @staticmethod
+    def update_location(user_id, lat, lng, label=None):
+        """Lightweight GPS ping written straight through. Returns the last-seen time."""
+        query, update = Driver.location_update(user_id, lat, lng, label)
+        mongo.db.drivers.update_one(query, update, upsert=True)
+        fields = update["$set"]
+        Driver.track_in_grid(user_id, lat, lng, fields["current_location"])
+        return fields["last_seen"]
+
+    @staticmethod
+    def get_pending_rides(after=None, limit=20, fields=PENDING_RIDE_FIELDS):
+        """Pending rides, oldest first, one keyset page at a time. Returns (rides, next_cursor)."""
+        docs, next_cursor = keyset_page(mongo.db.rides, {"status": "pending"}, fields,
+                                        after=after, limit=limit, direction=ASCENDING)
+        return load_many(RideRequest, docs, fields), next_cursor
+
+    @staticmethod
+    def get_available_drivers(limit=50, fields=DRIVER_LIST_FIELDS):
+        return load_many(Driver, mongo.db.drivers.find({"availability": True}, fields).limit(limit), fields)
+
+    @staticmethod
+    def nearest_available(lat, lng, radius_km=10, limit=10, fields=DRIVER_LIST_FIELDS):
+        """Closest available drivers to (lat, lng), nearest first. Uses the 2dsphere index on `location`."""
+        query = {
+            "availability": True,
+            "location": {
+                "$nearSphere": {
+                    "$geometry": to_point(lat, lng),
+                    "$maxDistance": radius_km * 1000,  # metres
+                }
+            },
+        }
+        return load_many(Driver, mongo.db.drivers.find(query, fields).limit(limit), fields)
+
+    @staticmethod
+    def nearby(lat, lng, radius_km=10, limit=10):
+        """Nearest available drivers from the in-memory grid, falling back to Mongo when it's empty."""
+        if len(driver_grid):
+            # Grid payloads hold exactly the list fields
+            return [Driver.from_doc(payload, DRIVER_LIST_FIELDS)
+                    for _, _, payload in driver_grid.nearest(lat, lng, k=limit, radius_km=radius_km)]
+        return Driver.nearest_available(lat, lng, radius_km=radius_km, limit=limit)
 
 
 # -------------------- TRIP MODEL --------------------
-class Trip:
+class Trip(Tracked):
+    FIELDS = {
+        "ride_request_id": None, "start_time": None, "end_time": None, "fare": 0.0,
+        "payment_status": "unpaid",  # unpaid, paid
+        "updated_at": None,
+    }
+    __slots__ = tuple(FIELDS)
+    UNTRACKED = ("updated_at",)
+
     def __init__(self, ride_request_id, start_time=None, end_time=None, fare=0.0,
                  payment_status="unpaid", _id=None):
         self.id = str(_id) if _id else None
@@ -132,21 +674,54 @@ class Trip:
         self.start_time = start_time or datetime.utcnow()
         self.end_time = end_time
         self.fare = fare
-        self.payment_status = payment_status  # unpaid, paid
+        self.payment_status = payment_status
+        self.updated_at = None
+
+    def to_doc(self):
+        doc = super().to_doc()
+        doc["updated_at"] = datetime.utcnow()
+        return doc
 
     def save_to_db(self):
-        trip_data = {
-            "ride_request_id": self.ride_request_id,
-            "start_time": self.start_time,
-            "end_time": self.end_time,
-            "fare": self.fare,
-            "payment_status": self.payment_status,
-        }
+        """Insert, or $set just the changed fields. Returns False when there was nothing to write."""
+        trip_data = self.to_doc()
         if self.id:
-            mongo.db.trips.update_one({"_id": self.id}, {"$set": trip_data})
+            changes = self.changes()
+            if not changes:
+                return False
+            mongo.db.trips.update_one({"_id": ObjectId(self.id)}, {"$set": self.stamped(changes, trip_data)})
         else:
             result = mongo.db.trips.insert_one(trip_data)
             self.id = str(result.inserted_id)
+        self.updated_at = trip_data["updated_at"]
+        self.mark_clean(trip_data)
+        return True
+
+    @staticmethod
+    def get_by_id(trip_id, fields=None):
+        if not ObjectId.is_valid(trip_id):
+            return None
+        return load_one(Trip, mongo.db.trips, {"_id": ObjectId(trip_id)}, fields)
+
+    @staticmethod
+    def save_many(trips, ordered=False):
+        return save_models(mongo.db.trips, trips, ordered)
+
+    @staticmethod
+    def bulk_close(fares, end_time=None, ordered=False):
+        """Finish many trips at once: {trip_id: fare}, all ending at `end_time` (default now)."""
+        end_time = end_time or datetime.utcnow()
+        updates = [(trip_id, {"$set": {"end_time": end_time, "fare": fare, "updated_at": datetime.utcnow()}})
+                   for trip_id, fare in fares.items()]
+        forget("trips", fares)
+        return update_by_ids(mongo.db.trips, updates, ordered)
+
+    @staticmethod
+    def bulk_set_payment_status(trip_ids, payment_status, ordered=False):
+        trip_ids = list(trip_ids)
+        update = {"$set": {"payment_status": payment_status, "updated_at": datetime.utcnow()}}
+        forget("trips", trip_ids)
+        return update_by_ids(mongo.db.trips, [(trip_id, update) for trip_id in trip_ids], ordered)
 
     @staticmethod
     def get_by_ride_request(ride_request_id):
@@ -0,0 +1,57 @@
+from bson import ObjectId
+from pymongo import DESCENDING
+
+
+# -------------------- KEYSET PAGINATION --------------------
+def clamp_limit(limit, default=20, maximum=100):
+    try:
+        limit = int(limit)
+    except (TypeError, ValueError):
+        return default
+    return max(1, min(limit, maximum))
+
+
+def keyset_page(collection, query, projection=None, after=None, limit=20, direction=DESCENDING):
+    """One page of `query` ordered by _id, starting after the `after` cursor.
+
+    Returns (docs, next_cursor); next_cursor is None on the last page. Unlike
+    skip/limit, each page is a bounded index range scan however deep you go.
+    """
+    # Fetch one extra document to know whether another page exists
+    cursor = collection.find(_after(query, after, direction), projection).sort("_id", direction).limit(limit + 1)
+    return _split_page(list(cursor), limit)
+
+
+async def keyset_page_async(collection, query, projection=None, after=None, limit=20, direction=DESCENDING):
+    """keyset_page for an async (AsyncMongoClient) collection."""
+    cursor = collection.find(_after(query, after, direction), projection).sort("_id", direction).limit(limit + 1)
+    return _split_page(await cursor.to_list(), limit)
+
+
+def keyset_aggregate(collection, query, pipeline, after=None, limit=20, direction=DESCENDING):
+    """keyset_page as an aggregation: the page is cut first, then `pipeline` (joins, $project) runs on it."""
+    stages = [
+        {"$match": _after(query, after, direction)},
+        {"$sort": {"_id": direction}},
+        {"$limit": limit + 1},
+        *pipeline,
+    ]
+    return _split_page(list(collection.aggregate(stages)), limit)
+
+
+def _after(query, after, direction):
+    query = dict(query)
+    if after and ObjectId.is_valid(after):
+        query["_id"] = {"$lt" if direction == DESCENDING else "$gt": ObjectId(after)}
+    return query
+
+
+def _split_page(docs, limit):
+    next_cursor = str(docs[limit - 1]["_id"]) if len(docs) > limit else None
+    return docs[:limit], next_cursor
+
+
+def serialize(docs):
+    """Make documents JSON-safe (ObjectIds to strings)."""
+    return [{k: str(v) if isinstance(v, ObjectId) else v for k, v in doc.items()} for doc in docs]
+
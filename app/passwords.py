@@ -0,0 +1,99 @@
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+
+class PasswordHasherBusy(RuntimeError):
+    """Raised when the hashing queue is full or a hash times out; callers should ask the user to retry."""
+
+
+def _noop():
+    return None
+
+
+# -------------------- PASSWORD HASHER --------------------
+class PasswordHasher:
+    """Runs Werkzeug's KDF on a bounded process pool instead of the request thread.
+
+    At most `workers + max_queue` hashes are in flight; beyond that calls fail
+    fast with PasswordHasherBusy rather than piling up behind a login burst.
+    With workers=0 everything runs inline (handy for tests and scripts).
+    """
+
+    def __init__(self, method="scrypt", workers=0, max_queue=32, timeout=10):
+        self._pool = None
+        self._lock = threading.Lock()
+        self.configure(method, workers, max_queue, timeout)
+
+    def configure(self, method=None, workers=None, max_queue=None, timeout=None):
+        with self._lock:
+            if method is not None:
+                self.method = method
+                # The exact prefix Werkzeug writes for this policy, e.g. "scrypt:32768:8:1"
+                self.policy = generate_password_hash("policy-probe", method).split("$", 1)[0]
+            if workers is not None:
+                self.workers = workers
+            if max_queue is not None:
+                self.max_queue = max_queue
+            if timeout is not None:
+                self.timeout = timeout
+            self._slots = threading.BoundedSemaphore(self.workers + self.max_queue)
+            if self._pool:
+                self._pool.shutdown(wait=False)
+                self._pool = None
+
+    def start(self):
+        """Create the pool and launch its workers now (before the app starts other threads)."""
+        with self._lock:
+            if self.workers and not self._pool:
+                self._pool = ProcessPoolExecutor(max_workers=self.workers)
+                self._pool.submit(_noop).result()
+        return self
+
+    def shutdown(self):
+        with self._lock:
+            if self._pool:
+                self._pool.shutdown()
+                self._pool = None
+
+    def _run(self, fn, *args):
+        if not self.workers:
+            return fn(*args)
+        slots = self._slots
+        if not slots.acquire(blocking=False):
+            raise PasswordHasherBusy("password hashing queue is full")
+        try:
+            if not self._pool:
+                self.start()
+            future = self._pool.submit(fn, *args)
+        except BaseException:
+            slots.release()
+            raise
+        # The slot is held until the work itself finishes, not just until we stop waiting for it
+        future.add_done_callback(lambda _: slots.release())
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            future.cancel()  # only helps while it's still queued
+            raise PasswordHasherBusy(f"password hashing took longer than {self.timeout}s") from None
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, self.method)
+
+    def verify(self, pwhash, password):
+        if not pwhash:
+            return False
+        return self._run(check_password_hash, pwhash, password)
+
+    def needs_rehash(self, pwhash):
+        """True if the stored hash was made with a different method or cost than the current policy."""
+        return bool(pwhash) and pwhash.split("$", 1)[0] != self.policy
+
+
+password_hasher = PasswordHasher(workers=0)
+
+
+def default_workers():
+    return max(1, (os.cpu_count() or 2) - 1)
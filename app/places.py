@@ -0,0 +1,217 @@
+import csv
+import logging
+import re
+import unicodedata
+from collections import namedtuple
+from math import asin, cos, isfinite, radians, sin
+
+from .cache import TTLCache
+from .geo import EARTH_RADIUS_KM, haversine_km, parse_latlng
+
+log = logging.getLogger(__name__)
+
+Place = namedtuple("Place", ["name", "lat", "lng", "weight"])
+
+
+def normalize(text):
+    """Lowercase, strip accents and punctuation, collapse whitespace."""
+    text = unicodedata.normalize("NFKD", str(text)).encode("ascii", "ignore").decode()
+    return " ".join(re.sub(r"[^a-z0-9]+", " ", text.lower()).split())
+
+
+# -------------------- PREFIX TRIE --------------------
+class PrefixTrie:
+    """Trie over every word of every place name.
+
+    Each node keeps the best `keep` place ids below it (by weight), so a lookup
+    is O(len(prefix)) however many places share the prefix.
+    """
+
+    def __init__(self, keep=10):
+        self.keep = keep
+        self._root = {}
+
+    def insert(self, key, place_id, weight):
+        node = self._root
+        for ch in key:
+            node = node.setdefault(ch, {})
+            top = node.setdefault("", [])  # "" never clashes with a character key
+            if place_id in (pid for _, pid in top):
+                continue
+            top.append((-weight, place_id))
+            top.sort()
+            del top[self.keep:]
+
+    def search(self, prefix):
+        node = self._root
+        for ch in prefix:
+            node = node.get(ch)
+            if node is None:
+                return []
+        return [pid for _, pid in node.get("", [])]
+
+
+# -------------------- KD-TREE --------------------
+def unit_vector(lat, lng):
+    lat, lng = radians(lat), radians(lng)
+    return cos(lat) * cos(lng), cos(lat) * sin(lng), sin(lat)
+
+
+class KDTree:
+    """Static 3-d tree over unit vectors of (lat, lng), for nearest-place lookups.
+
+    Straight-line (chord) distance between unit vectors orders points exactly
+    like great-circle distance, so no special casing near the poles or the
+    antimeridian is needed.
+    """
+
+    def __init__(self, latlngs):
+        points = [unit_vector(lat, lng) for lat, lng in latlngs]
+        self._nodes = []  # (point, index, axis, left, right)
+        self._root = self._build(list(range(len(points))), points, 0)
+
+    def __len__(self):
+        return len(self._nodes)
+
+    def _build(self, ids, points, depth):
+        if not ids:
+            return -1
+        axis = depth % 3
+        ids.sort(key=lambda i: points[i][axis])
+        mid = len(ids) // 2
+        node = len(self._nodes)
+        self._nodes.append(None)
+        left = self._build(ids[:mid], points, depth + 1)
+        right = self._build(ids[mid + 1:], points, depth + 1)
+        self._nodes[node] = (points[ids[mid]], ids[mid], axis, left, right)
+        return node
+
+    def nearest(self, lat, lng):
+        """(index, distance_km) of the closest point, or None if the tree is empty."""
+        if self._root < 0:
+            return None
+        q = unit_vector(lat, lng)
+        best_d2, best_i = float("inf"), None
+        stack = [(self._root, 0.0)]
+        while stack:
+            node, bound = stack.pop()
+            if node < 0 or bound >= best_d2:
+                continue
+            p, i, axis, left, right = self._nodes[node]
+            d2 = (q[0] - p[0]) ** 2 + (q[1] - p[1]) ** 2 + (q[2] - p[2]) ** 2
+            if d2 < best_d2:
+                best_d2, best_i = d2, i
+            diff = q[axis] - p[axis]
+            near, far = (left, right) if diff < 0 else (right, left)
+            stack.append((far, diff * diff))
+            stack.append((near, 0.0))
+        chord = best_d2 ** 0.5
+        return best_i, 2 * EARTH_RADIUS_KM * asin(min(chord / 2, 1.0))
+
+
+# -------------------- GAZETTEER --------------------
+class Gazetteer:
+    """Local place names for autocomplete and forward/reverse geocoding, loaded from a CSV (name,lat,lng[,weight])."""
+
+    def __init__(self, cache_size=5_000, cache_ttl=3600, reverse_cell_deg=0.001, reverse_max_km=1.0):
+        self.places = []
+        self._by_name = {}
+        self._trie = PrefixTrie()
+        self._tree = KDTree([])
+        self.cache = TTLCache(maxsize=cache_size, ttl=cache_ttl)
+        # Reverse lookups are cached per ~110 m cell; places further than reverse_max_km don't name a point
+        self.reverse_cell_deg = reverse_cell_deg
+        self.reverse_max_km = reverse_max_km
+        self.reverse_cache = TTLCache(maxsize=cache_size * 4, ttl=cache_ttl)
+
+    def __len__(self):
+        return len(self.places)
+
+    def load_csv(self, path):
+        try:
+            with open(path, newline="", encoding="utf-8") as f:
+                rows = list(csv.DictReader(f))
+        except FileNotFoundError:
+            log.warning("places file %s not found; geocoding only accepts coordinates", path)
+            return 0
+        self.places = []
+        self._by_name = {}
+        self._trie = PrefixTrie()
+        self.cache.clear()
+        for row in rows:
+            try:
+                self.add(row["name"], float(row["lat"]), float(row["lng"]), float(row.get("weight") or 0))
+            except (KeyError, ValueError):
+                log.warning("skipping bad places row: %r", row)
+        self.build_reverse_index()
+        return len(self.places)
+
+    def build_reverse_index(self):
+        """(Re)build the KD-tree; call once after adding places."""
+        self._tree = KDTree([(p.lat, p.lng) for p in self.places])
+        self.reverse_cache.clear()
+
+    def add(self, name, lat, lng, weight=0.0):
+        place_id = len(self.places)
+        self.places.append(Place(name, lat, lng, weight))
+        key = normalize(name)
+        self._by_name.setdefault(key, place_id)
+        # Index the full name and every word suffix, so "mall" finds "Two Rivers Mall"
+        words = key.split()
+        for i in range(len(words)):
+            self._trie.insert(" ".join(words[i:]), place_id, weight)
+        return place_id
+
+    def autocomplete(self, query, limit=5):
+        key = normalize(query)
+        if not key:
+            return []
+        cache_key = ("ac", key, limit)
+        hits = self.cache.get(cache_key)
+        if hits is None:
+            ids = self._trie.search(key)
+            # Names that start with the query rank ahead of mid-name word matches
+            ids.sort(key=lambda pid: not normalize(self.places[pid].name).startswith(key))
+            hits = [self.places[pid] for pid in ids[:limit]]
+            self.cache.set(cache_key, hits)
+        return hits
+
+    def geocode(self, text):
+        """Resolve a pickup/destination to a Place: coordinates, else an exact (normalized) name, else None.
+
+        Deliberately no prefix guessing: "West" must not silently become
+        Westlands and drive ETA, dispatch and fares. Partial text is what
+        autocomplete() is for.
+        """
+        latlng = parse_latlng(text)
+        if latlng:
+            label = str(text).split("|", 1)[1].strip() if "|" in str(text) else f"{latlng[0]},{latlng[1]}"
+            return Place(label, latlng[0], latlng[1], 0.0)
+        place_id = self._by_name.get(normalize(text))
+        return self.places[place_id] if place_id is not None else None
+
+    def reverse(self, lat, lng):
+        """(Place, distance_km) of the nearest known place within reverse_max_km, or None."""
+        if not (isfinite(lat) and isfinite(lng)):
+            return None
+        cell = (round(lat / self.reverse_cell_deg), round(lng / self.reverse_cell_deg))
+        hit = self.reverse_cache.get(cell)
+        if hit is None:
+            # Answer for the cell centre, so every point in the cell shares one cache entry
+            found = self._tree.nearest(cell[0] * self.reverse_cell_deg, cell[1] * self.reverse_cell_deg)
+            if found and found[1] <= self.reverse_max_km:
+                hit = (self.places[found[0]], found[1])
+            else:
+                hit = False  # cache misses too
+            self.reverse_cache.set(cell, hit)
+        if not hit:
+            return None
+        place = hit[0]
+        return place, haversine_km(lat, lng, place.lat, place.lng)
+
+
+def place_json(place):
+    return {"name": place.name, "lat": place.lat, "lng": place.lng}
+
+
+gazetteer = Gazetteer()
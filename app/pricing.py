@@ -0,0 +1,134 @@
+import threading
+import time
+from collections import Counter, namedtuple
+from math import floor
+
+from . import mongo
+from .geo import doc_latlng, estimate_eta
+from .spatial import driver_grid
+
+# A fare estimate: fare = max(minimum, base + per km + per minute) * surge
+Quote = namedtuple("Quote", ["fare", "surge", "km", "minutes", "currency"])
+
+
+# -------------------- SURGE --------------------
+class SurgeTable:
+    """Surge multiplier per geo cell from pending rides (demand) vs available drivers (supply).
+
+    Quotes only read a cached dict. The table is rebuilt at most once every
+    `refresh_seconds` by the first quote that finds it stale; concurrent quotes
+    keep using the previous table meanwhile. A rebuild is one projected query
+    over pending rides plus a walk of the in-memory driver grid, and only the
+    cells whose counts moved since the last rebuild get a new multiplier.
+    """
+
+    def __init__(self, cell_deg=0.02, refresh_seconds=60, sensitivity=0.5, min_demand=3, max_surge=3.0):
+        self.cell_deg = cell_deg
+        self.refresh_seconds = refresh_seconds
+        self.sensitivity = sensitivity
+        self.min_demand = min_demand
+        self.max_surge = max_surge
+        self._counts = {}       # cell -> (demand, supply)
+        self._multipliers = {}  # cell -> surge, only for cells above 1.0
+        self._refreshed_at = None
+        self._refresh_lock = threading.Lock()
+        self.counters = {"refreshes": 0, "cells_changed": 0, "last_refresh_ms": 0.0}
+
+    def configure(self, cell_deg, refresh_seconds, sensitivity, min_demand, max_surge):
+        if cell_deg != self.cell_deg:
+            self._counts, self._multipliers, self._refreshed_at = {}, {}, None
+        self.cell_deg = cell_deg
+        self.refresh_seconds = refresh_seconds
+        self.sensitivity = sensitivity
+        self.min_demand = min_demand
+        self.max_surge = max_surge
+
+    def cell(self, lat, lng):
+        return floor(lat / self.cell_deg), floor(lng / self.cell_deg)
+
+    def multiplier(self, lat, lng):
+        self.refresh_if_stale()
+        return self._multipliers.get(self.cell(lat, lng), 1.0)
+
+    def surge(self, demand, supply):
+        """Multiplier for one cell: 1.0 until pending rides outnumber drivers, then linear in the ratio."""
+        if demand < self.min_demand or demand <= supply:
+            return 1.0
+        ratio = demand / max(supply, 1)
+        return min(self.max_surge, round(1 + self.sensitivity * (ratio - 1), 1))
+
+    def refresh_if_stale(self):
+        if self._refreshed_at is not None and time.monotonic() - self._refreshed_at < self.refresh_seconds:
+            return
+        if not self._refresh_lock.acquire(blocking=False):
+            return  # another request is rebuilding it
+        try:
+            self.refresh()
+        finally:
+            self._refresh_lock.release()
+
+    def refresh(self):
+        start = time.perf_counter()
+        demand = Counter()
+        for doc in mongo.db.rides.find({"status": "pending"}, {"_id": 0, "pickup": 1, "pickup_location": 1}):
+            point = doc_latlng(doc, "pickup")
+            if point:
+                demand[self.cell(*point)] += 1
+        supply = Counter(self.cell(lat, lng) for lat, lng in driver_grid.positions())
+        counts = {cell: (demand[cell], supply[cell]) for cell in demand.keys() | supply.keys()}
+
+        multipliers = dict(self._multipliers)
+        changed = 0
+        for cell in self._counts.keys() | counts.keys():
+            if self._counts.get(cell) == counts.get(cell):
+                continue
+            changed += 1
+            surge = self.surge(*counts.get(cell, (0, 0)))
+            if surge > 1.0:
+                multipliers[cell] = surge
+            else:
+                multipliers.pop(cell, None)
+
+        # Swap whole dicts so quotes never see a half-built table
+        self._counts, self._multipliers = counts, multipliers
+        self._refreshed_at = time.monotonic()
+        self.counters["refreshes"] += 1
+        self.counters["cells_changed"] += changed
+        self.counters["last_refresh_ms"] = round((time.perf_counter() - start) * 1000, 3)
+
+    def stats(self):
+        return {**self.counters, "cells": len(self._counts), "surging_cells": len(self._multipliers),
+                "max_multiplier": max(self._multipliers.values(), default=1.0)}
+
+
+# -------------------- FARES --------------------
+class Pricing:
+    """Fare estimates from great-circle distance and drive time, times the pickup cell's surge."""
+
+    def __init__(self, base_fare=100.0, per_km=50.0, per_minute=4.0, minimum=200.0, currency="KES"):
+        self.base_fare = base_fare
+        self.per_km = per_km
+        self.per_minute = per_minute
+        self.minimum = minimum
+        self.currency = currency
+        self.surge = SurgeTable()
+
+    def configure(self, base_fare, per_km, per_minute, minimum, currency):
+        self.base_fare = base_fare
+        self.per_km = per_km
+        self.per_minute = per_minute
+        self.minimum = minimum
+        self.currency = currency
+
+    def quote(self, pickup, destination):
+        """Quote for two (lat, lng) tuples, or None if either is unknown."""
+        if not pickup or not destination:
+            return None
+        eta = estimate_eta(pickup, destination)
+        minutes = eta.seconds / 60
+        fare = max(self.minimum, self.base_fare + self.per_km * eta.km + self.per_minute * minutes)
+        surge = self.surge.multiplier(*pickup)
+        return Quote(round(fare * surge, 2), surge, round(eta.km, 3), round(minutes, 1), self.currency)
+
+
+pricing = Pricing()
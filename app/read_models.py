@@ -0,0 +1,72 @@
+from pymongo import ASCENDING, DESCENDING
+
+from . import mongo
+from .models import PENDING_RIDE_FIELDS, RIDER_RIDE_FIELDS, RideRequest, load_many
+from .pagination import keyset_aggregate
+
+
+# -------------------- PIPELINE PIECES --------------------
+# Rides reference users by their string id, so joins on users._id convert it first
+def as_object_id(path):
+    return {"$convert": {"input": path, "to": "objectId", "onError": None, "onNull": None}}
+
+
+def first(path):
+    """The first element of a $lookup result array (missing when the join found nothing)."""
+    return {"$arrayElemAt": [path, 0]}
+
+
+def lookup_user(id_field, as_field):
+    """Stages that join the users document whose _id is the string id in `id_field`."""
+    return [
+        {"$addFields": {as_field: as_object_id(f"${id_field}")}},
+        {"$lookup": {"from": "users", "localField": as_field, "foreignField": "_id", "as": as_field}},
+    ]
+
+
+def rows(docs, fields, summary_field):
+    """[(ride model, summary dict or None)] from aggregated ride documents."""
+    summaries = [doc.pop(summary_field, None) or None for doc in docs]
+    return list(zip(load_many(RideRequest, docs, fields), summaries))
+
+
+# -------------------- RIDER: MY RIDES WITH THEIR DRIVER --------------------
+RIDES_WITH_DRIVER = [
+    *lookup_user("driver_id", "driver_user"),
+    {"$lookup": {"from": "drivers", "localField": "driver_id", "foreignField": "user_id", "as": "driver_doc"}},
+    {"$project": {
+        **RIDER_RIDE_FIELDS,
+        "driver": {
+            "name": first("$driver_user.name"),
+            "phone": first("$driver_user.phone"),
+            "vehicle": first("$driver_doc.vehicle_details.info"),
+        },
+    }},
+]
+
+
+def rides_with_driver(rider_id, after=None, limit=20):
+    """A rider's rides, newest first, each with its driver's name, phone and vehicle, in one aggregation.
+
+    Returns ([(ride, driver)], next_cursor); driver is None until the ride is accepted.
+    """
+    docs, next_cursor = keyset_aggregate(mongo.db.rides, {"rider_id": rider_id}, RIDES_WITH_DRIVER,
+                                         after=after, limit=limit, direction=DESCENDING)
+    return rows(docs, RIDER_RIDE_FIELDS, "driver"), next_cursor
+
+
+# -------------------- DRIVER: PENDING RIDES WITH THEIR RIDER --------------------
+PENDING_WITH_RIDER = [
+    *lookup_user("rider_id", "rider_user"),
+    {"$project": {**PENDING_RIDE_FIELDS, "rider": {"name": first("$rider_user.name")}}},
+]
+
+
+def pending_rides_with_rider(after=None, limit=20):
+    """Pending rides, oldest first, each with the rider's name, in one aggregation.
+
+    Returns ([(ride, rider)], next_cursor).
+    """
+    docs, next_cursor = keyset_aggregate(mongo.db.rides, {"status": "pending"}, PENDING_WITH_RIDER,
+                                         after=after, limit=limit, direction=ASCENDING)
+    return rows(docs, PENDING_RIDE_FIELDS, "rider"), next_cursor
@@ -0,0 +1,130 @@
+import logging
+from datetime import date, datetime, time, timedelta
+
+import click
+from bson import ObjectId
+from pymongo import DeleteMany, ReplaceOne
+
+log = logging.getLogger(__name__)
+
+JOB_NAME = "daily_stats"
+# Writes stamped just before a run may commit after it has read; re-read this much each time
+WATERMARK_OVERLAP = timedelta(minutes=2)
+
+
+# -------------------- DAILY STATS ROLL-UP --------------------
+def day_bounds(day):
+    start = datetime.combine(day, time.min)
+    return start, start + timedelta(days=1)
+
+
+def empty_row():
+    return {"rides": 0, "completed_rides": 0, "accepted_rides": 0, "acceptance_seconds": 0.0,
+            "trips": 0, "revenue": 0.0}
+
+
+def compute_day(db, day):
+    """{driver_id or None (all drivers): counters} for one day, read only from that day's documents.
+
+    Rides count on the day they were requested (their _id time), trips on
+    the day they started; a trip is credited to the driver of its ride.
+    """
+    start, end = day_bounds(day)
+    rows = {None: empty_row()}
+
+    def bump(driver_id, **amounts):
+        for key in {None, driver_id}:
+            row = rows.setdefault(key, empty_row())
+            for name, amount in amounts.items():
+                row[name] += amount
+
+    rides = db.rides.find(
+        {"_id": {"$gte": ObjectId.from_datetime(start), "$lt": ObjectId.from_datetime(end)}},
+        {"driver_id": 1, "status": 1, "accepted_at": 1},
+    )
+    for ride in rides:
+        accepted_at = ride.get("accepted_at")
+        requested_at = ride["_id"].generation_time.replace(tzinfo=None)
+        bump(ride.get("driver_id"), rides=1, completed_rides=int(ride.get("status") == "completed"),
+             accepted_rides=int(accepted_at is not None),
+             acceptance_seconds=(accepted_at - requested_at).total_seconds() if accepted_at else 0.0)
+
+    trips = list(db.trips.find({"start_time": {"$gte": start, "$lt": end}}, {"ride_request_id": 1, "fare": 1}))
+    ride_ids = {t["ride_request_id"] for t in trips if ObjectId.is_valid(t.get("ride_request_id"))}
+    drivers = {str(r["_id"]): r.get("driver_id")
+               for r in db.rides.find({"_id": {"$in": [ObjectId(i) for i in ride_ids]}}, {"driver_id": 1})}
+    for trip in trips:
+        bump(drivers.get(trip.get("ride_request_id")), trips=1, revenue=float(trip.get("fare") or 0))
+    return rows
+
+
+def stats_doc(day, driver_id, row, now):
+    accepted = row.pop("accepted_rides")
+    seconds = row.pop("acceptance_seconds")
+    return {
+        "_id": f"{day.isoformat()}:{driver_id or 'all'}",
+        "day": day.isoformat(),
+        "driver_id": driver_id,
+        **row,
+        "revenue": round(row["revenue"], 2),
+        "accepted_rides": accepted,
+        "avg_acceptance_seconds": round(seconds / accepted, 1) if accepted else None,
+        "refreshed_at": now,
+    }
+
+
+def touched_days(db, since):
+    """Days whose rides or trips were written after `since` (every day on the first run)."""
+    query = {"updated_at": {"$gt": since}} if since else {}
+    days = {ride["_id"].generation_time.date() for ride in db.rides.find(query, {"_id": 1})}
+    days |= {trip["start_time"].date() for trip in db.trips.find(query, {"start_time": 1}) if trip.get("start_time")}
+    return days
+
+
+def refresh_daily_stats(db, now=None):
+    """Recompute `daily_stats` for the days touched since the stored watermark, then advance it.
+
+    Each touched day is rebuilt from scratch and replaces its previous
+    documents, so running twice (or two runs at once) gives the same result.
+    Returns {"days": [...], "documents": n, "watermark": datetime}.
+    """
+    now = now or datetime.utcnow()
+    state = db.job_state.find_one({"_id": JOB_NAME}) or {}
+    since = state.get("watermark")
+    days = sorted(touched_days(db, since - WATERMARK_OVERLAP if since else None))
+
+    written = 0
+    for day in days:
+        docs = [stats_doc(day, driver_id, row, now) for driver_id, row in compute_day(db, day).items()]
+        ops = [ReplaceOne({"_id": doc["_id"]}, doc, upsert=True) for doc in docs]
+        # Drivers who no longer have anything on that day
+        ops.append(DeleteMany({"day": day.isoformat(), "_id": {"$nin": [doc["_id"] for doc in docs]}}))
+        db.daily_stats.bulk_write(ops, ordered=False)
+        written += len(docs)
+
+    # $max: a slower concurrent run can never move the watermark backwards
+    db.job_state.update_one({"_id": JOB_NAME}, {"$max": {"watermark": now}}, upsert=True)
+    log.info("daily_stats: refreshed %d days (%d documents)", len(days), written)
+    return {"days": [d.isoformat() for d in days], "documents": written, "watermark": now}
+
+
+def read_daily_stats(db, start, end, driver_id=None):
+    """Stored summaries for days in [start, end], all drivers combined unless `driver_id` is given."""
+    query = {"day": {"$gte": start.isoformat(), "$lte": end.isoformat()}, "driver_id": driver_id}
+    return list(db.daily_stats.find(query, {"_id": 0}).sort("day", 1))
+
+
+def parse_day(text, default):
+    try:
+        return date.fromisoformat(text) if text else default
+    except ValueError:
+        return None
+
+
+# -------------------- CLI --------------------
+def register_commands(app, mongo):
+    @app.cli.command("refresh-daily-stats")
+    def refresh_daily_stats_command():
+        """Roll rides and trips changed since the last run up into daily_stats (safe to rerun; cron it)."""
+        result = refresh_daily_stats(mongo.db)
+        click.echo(f"refreshed {len(result['days'])} days, {result['documents']} documents")
@@ -0,0 +1,221 @@
+import atexit
+import logging
+import threading
+from datetime import datetime
+
+import click
+from bson import ObjectId
+from pymongo.errors import PyMongoError
+
+from . import mongo
+
+log = logging.getLogger(__name__)
+
+# Ride status -> the event recorded when a ride moves into it ("created" is recorded on insert)
+STATUS_EVENTS = {"accepted": "accepted", "in_progress": "started", "completed": "completed", "cancelled": "cancelled"}
+EVENT_STATUS = {"created": "pending", **{event: status for status, event in STATUS_EVENTS.items()}}
+# Latency stages: (from event, to event)
+STAGES = {
+    "accept": ("created", "accepted"),
+    "pickup": ("accepted", "started"),
+    "trip": ("started", "completed"),
+    "cancel": ("created", "cancelled"),
+}
+
+
+def log_entry(ride_id, event, at=None, **data):
+    """One log entry. The _id is assigned here, so _id order is record order within a process."""
+    return {"_id": ObjectId(), "ride_id": str(ride_id), "type": event, "at": at or datetime.utcnow(),
+            **{k: v for k, v in data.items() if v is not None}}
+
+
+def status_entry(ride_id, status, at=None, **data):
+    """The event for a move into `status`, or None if that status isn't a logged transition."""
+    event = STATUS_EVENTS.get(status)
+    return log_entry(ride_id, event, at, **data) if event else None
+
+
+# -------------------- EVENT LOG --------------------
+class RideEventLog:
+    """Append-only `ride_events` log, written in batches.
+
+    With the flusher running, record() only appends to an in-memory batch
+    that is insert_many()'d every `flush_interval_ms` or as soon as
+    `flush_batch` events wait. Without it (scripts, CLI), and whenever the
+    batch is full, the caller writes its own events straight away, so
+    events are never dropped for lack of room. The `rides` documents stay
+    the source for every hot-path read; the log is for replay and audit.
+    """
+
+    def __init__(self, flush_interval_ms=200, flush_batch=500, max_pending=50_000):
+        self.flush_interval_ms = flush_interval_ms
+        self.flush_batch = flush_batch
+        self.max_pending = max_pending
+        self.counters = {"recorded": 0, "flushed": 0, "flushes": 0, "direct_writes": 0, "errors": 0}
+        self._pending = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._collection = None
+
+    def record(self, events):
+        events = [event for event in events if event]
+        if not events:
+            return
+        running = self._thread is not None and self._thread.is_alive()
+        with self._lock:
+            self.counters["recorded"] += len(events)
+            if running and len(self._pending) + len(events) <= self.max_pending:
+                self._pending.extend(events)
+                if len(self._pending) >= self.flush_batch:
+                    self._wake.set()
+                return
+            self.counters["direct_writes"] += 1
+        self._insert(self._collection if self._collection is not None else mongo.db.ride_events, events)
+
+    def _insert(self, collection, events):
+        try:
+            collection.insert_many(events, ordered=False)
+            return True
+        except PyMongoError:
+            log.exception("could not write %d ride events", len(events))
+            with self._lock:
+                self.counters["errors"] += 1
+            return False
+
+    def flush(self):
+        """Write everything buffered so far. Returns the number of events written."""
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, []
+            if not batch:
+                return 0
+            if not self._insert(self._collection, batch):
+                with self._lock:
+                    # Retry with the next flush, ahead of newer events
+                    self._pending[:0] = batch[: max(self.max_pending - len(self._pending), 0)]
+                return 0
+            with self._lock:
+                self.counters["flushed"] += len(batch)
+                self.counters["flushes"] += 1
+            return len(batch)
+
+    def start(self, collection):
+        """Start the background flusher; buffered events are flushed again at interpreter exit."""
+        self._collection = collection
+        if self._thread and self._thread.is_alive():
+            return self._thread
+        self._stop.clear()
+
+        def run():
+            while not self._stop.is_set():
+                self._wake.wait(self.flush_interval_ms / 1000)
+                self._wake.clear()
+                self.flush()
+
+        self._thread = threading.Thread(target=run, name="ride-event-flusher", daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+        return self._thread
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+        if self._collection is not None:
+            self.flush()
+
+    def stats(self):
+        with self._lock:
+            return {**self.counters, "pending": len(self._pending), "max_pending": self.max_pending}
+
+
+ride_log = RideEventLog()
+
+
+# -------------------- PROJECTOR --------------------
+def project(events):
+    """Fold events, oldest first, into {ride_id: state} with the status and every transition time.
+
+    A transition logged twice (e.g. a driver re-claiming a ride they already
+    hold) keeps its first time, so replaying duplicates changes nothing.
+    """
+    states = {}
+    for event in events:
+        state = states.setdefault(event["ride_id"], {"ride_id": event["ride_id"], "status": None,
+                                                     "driver_id": None, "events": 0})
+        state["status"] = EVENT_STATUS.get(event["type"], state["status"])
+        state.setdefault(f"{event['type']}_at", event["at"])
+        if event.get("driver_id"):
+            state["driver_id"] = event["driver_id"]
+        state["events"] += 1
+    return states
+
+
+def rebuild_ride_states(db, ride_ids=None, since=None):
+    """Current state of rides replayed from the log (all rides, some ids, or events since a date)."""
+    query = {}
+    if ride_ids is not None:
+        query["ride_id"] = {"$in": [str(i) for i in ride_ids]}
+    if since:
+        query["at"] = {"$gte": since}
+    return project(db.ride_events.find(query, {"_id": 0}).sort([("at", 1), ("_id", 1)]))
+
+
+def percentile(values, p):
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def stage_latencies(states):
+    """{stage: {count, mean, p50, p95, max}} in seconds, from the transition times of rebuilt states."""
+    samples = {stage: [] for stage in STAGES}
+    for state in states.values():
+        for stage, (start, end) in STAGES.items():
+            if state.get(f"{start}_at") and state.get(f"{end}_at"):
+                samples[stage].append((state[f"{end}_at"] - state[f"{start}_at"]).total_seconds())
+    report = {}
+    for stage, values in samples.items():
+        values.sort()
+        report[stage] = {
+            "count": len(values),
+            "mean": round(sum(values) / len(values), 1) if values else None,
+            "p50": round(percentile(values, 50), 1) if values else None,
+            "p95": round(percentile(values, 95), 1) if values else None,
+            "max": round(values[-1], 1) if values else None,
+        }
+    return report
+
+
+def audit_rides(db, states):
+    """Rides whose stored status or driver disagrees with the log: [(ride_id, stored, replayed)]."""
+    ids = [ObjectId(i) for i in states if ObjectId.is_valid(i)]
+    mismatches = []
+    for ride in db.rides.find({"_id": {"$in": ids}}, {"status": 1, "driver_id": 1}):
+        state = states[str(ride["_id"])]
+        stored = (ride.get("status"), ride.get("driver_id"))
+        if stored != (state["status"], state["driver_id"]):
+            mismatches.append((str(ride["_id"]), stored, (state["status"], state["driver_id"])))
+    return mismatches
+
+
+# -------------------- CLI --------------------
+def register_commands(app, mongo):
+    @app.cli.command("ride-events")
+    @click.option("--since", type=click.DateTime(["%Y-%m-%d"]), help="only replay events from this day (YYYY-MM-DD)")
+    @click.option("--audit", is_flag=True, help="compare the replayed state with the rides collection")
+    def ride_events_command(since, audit):
+        """Rebuild ride state from the event log and print per-stage latencies."""
+        states = rebuild_ride_states(mongo.db, since=since)
+        click.echo(f"{len(states)} rides replayed")
+        for stage, row in stage_latencies(states).items():
+            click.echo(f"{stage:<8} n={row['count']:<7} mean={row['mean']}s p50={row['p50']}s "
+                       f"p95={row['p95']}s max={row['max']}s")
+        if audit:
+            mismatches = audit_rides(mongo.db, states)
+            for ride_id, stored, replayed in mismatches:
+                click.echo(f"MISMATCH {ride_id}: rides={stored} log={replayed}")
+            if mismatches:
+                raise click.ClickException(f"{len(mismatches)} rides disagree with the event log")
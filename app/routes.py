@@ -1,14 +1,49 @@
 
-from flask import Blueprint, render_template, redirect, url_for, flash, request
+import hmac
+import queue
+import random
+import time
+from datetime import datetime, timedelta
+from flask import Blueprint, Response, render_template, redirect, url_for, flash, request, current_app, jsonify, g
 from flask_login import login_user, logout_user, login_required, current_user
 from bson.objectid import ObjectId
 from . import mongo
-from .forms import SignupForm, LoginForm, RideRequestForm, DriverAvailabilityForm
-from .models import User, RideRequest, Driver, Trip
+from .forms import SignupForm, LoginForm, RideRequestForm, DriverAvailabilityForm, AcceptRideForm
+from .models import User, RideRequest, Driver
+from .read_models import rides_with_driver, pending_rides_with_rider
+from .geo import estimate_eta, from_point, parse_latlng
+from .spatial import driver_grid
+from .events import ride_hub, ride_event, format_sse
+from .pagination import clamp_limit, serialize
+from .ingest import location_buffer
+from .places import gazetteer, place_json
+from .passwords import PasswordHasherBusy
+from .metrics import request_metrics, render_prometheus
+from .pricing import pricing
+from .heatmap import demand_heatmap
+from .reports import parse_day, read_daily_stats
+from .ride_log import ride_log, rebuild_ride_states, stage_latencies
 
 main = Blueprint("main", __name__)
 
 
+# -------------------- REQUEST METRICS --------------------
+@main.before_request
+def start_request_metrics():
+    request_metrics.start()
+
+@main.after_request
+def remember_response_status(response):
+    g.response_status = response.status_code
+    return response
+
+@main.teardown_request
+def record_request_metrics(exc):
+    # Teardown also runs when the view raised, so failed requests (often the slow ones) are counted too
+    status = 500 if exc is not None else g.get("response_status", 500)
+    request_metrics.finish(request.endpoint, request.method, status, current_app.config["SLOW_REQUEST_MS"])
+
+
 # -------------------- HOME --------------------
 @main.route("/")
 def home():
@@ -27,13 +62,17 @@ def signup():
             return redirect(url_for("main.login"))
 
         # Create new user
-        user = User(
-            name=form.name.data,
-            email=form.email.data,
-            phone=form.phone.data,
-            password=form.password.data,
-            role=form.role.data
-        )
+        try:
+            user = User(
+                name=form.name.data,
+                email=form.email.data,
+                phone=form.phone.data,
+                password=form.password.data,
+                role=form.role.data
+            )
+        except PasswordHasherBusy:
+            flash("We're very busy right now. Please try again in a moment.", "warning")
+            return render_template("signup.html", form=form), 503
         user.save_to_db()
         flash("Signup successful. Please login.", "success")
         return redirect(url_for("main.login"))
@@ -47,7 +86,18 @@ def login():
     form = LoginForm()
     if form.validate_on_submit():
         user = User.get_by_email(form.email.data)
-        if user and user.check_password(form.password.data):
+        try:
+            valid = bool(user) and user.check_password(form.password.data)
+        except PasswordHasherBusy:
+            flash("Lots of people are signing in right now. Please try again in a moment.", "warning")
+            return render_template("login.html", form=form), 503
+        if valid:
+            # Transparently move old hashes onto the current PASSWORD_HASH_METHOD
+            try:
+                user.rehash_password_if_needed(form.password.data)
+            except PasswordHasherBusy:
+                # Opportunistic only: the upgrade waits for the next login
+                current_app.logger.info("password rehash for user %s skipped: hasher busy", user.id)
             login_user(user)
             flash("Logged in successfully.", "success")
             return redirect(url_for("main.home"))
@@ -80,8 +130,13 @@ def request_ride():
             destination=form.destination.data,
             rider_id=current_user.id
         )
+        quote = ride.quote_fare()
         ride.save_to_db()
-        flash("Ride request submitted!", "success")
+        if quote:
+            surge = f" ({quote.surge:g}x surge)" if quote.surge > 1 else ""
+            flash(f"Ride request submitted! Estimated fare: {quote.currency} {quote.fare:,.0f}{surge}.", "success")
+        else:
+            flash("Ride request submitted!", "success")
 
         # Redirect based on role
         if current_user.role in ["rider", "customer"]:
@@ -93,10 +148,42 @@ def request_ride():
 
 
 
-# -------------------- DRIVER DASHBOARD --------------------
-from bson import ObjectId
-from .forms import DriverAvailabilityForm, AcceptRideForm
+# -------------------- PLACES --------------------
+@main.route("/api/places/autocomplete")
+@login_required
+def places_autocomplete():
+    limit = clamp_limit(request.args.get("limit"), default=5, maximum=20)
+    return {"results": [place_json(p) for p in gazetteer.autocomplete(request.args.get("q", ""), limit)]}
+
+
+@main.route("/api/places/geocode")
+@login_required
+def places_geocode():
+    place = gazetteer.geocode(request.args.get("q", ""))
+    if not place:
+        return {"error": "no match"}, 404
+    return {"result": place_json(place)}
+
+
+@main.route("/api/places/reverse")
+@login_required
+def places_reverse():
+    try:
+        lat, lng = float(request.args["lat"]), float(request.args["lng"])
+    except (KeyError, ValueError):
+        return {"error": "lat and lng are required"}, 400
+    # Also rejects nan/inf, which fail every comparison
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+        return {"error": "lat/lng out of range"}, 400
+    hit = gazetteer.reverse(lat, lng)
+    if not hit:
+        return {"error": "no known place nearby"}, 404
+    place, distance_km = hit
+    return {"result": {**place_json(place), "distance_km": round(distance_km, 3)}}
+
 
+
+# -------------------- DRIVER DASHBOARD --------------------
 @main.route("/driver", methods=["GET", "POST"])
 @login_required
 def driver_dashboard():
@@ -116,20 +203,75 @@ def driver_dashboard():
         flash("Driver availability updated.", "success")
 
 
-    # get pending rides
-    pending_rides = Driver.get_pending_rides()
+    # get one page of pending rides, with each rider's name joined in
+    pending_rides, next_cursor = pending_rides_with_rider(**page_args())
 
     # create one accept form per ride
-    accept_forms = {ride["_id"]: AcceptRideForm() for ride in pending_rides}
+    accept_forms = {ride.id: AcceptRideForm() for ride, _ in pending_rides}
 
     return render_template(
         "driver_dashboard.html",
         form=availability_form,
         rides=pending_rides,
-        accept_forms=accept_forms
+        accept_forms=accept_forms,
+        auto_dispatch=current_app.config["DISPATCH_MODE"] == "auto",
+        next_cursor=next_cursor,
     )
 
 
+# -------------------- DRIVER LOCATION PING --------------------
+@main.route("/api/driver/location", methods=["POST"])
+@login_required
+def driver_location():
+    """JSON GPS ping: {"lat": .., "lng": .., "label": optional}. Send the CSRF token as X-CSRFToken."""
+    if current_user.role != "driver":
+        return {"error": "drivers only"}, 403
+
+    data = request.get_json(silent=True) or {}
+    try:
+        lat, lng = float(data["lat"]), float(data["lng"])
+    except (KeyError, TypeError, ValueError):
+        return {"error": "lat and lng are required"}, 400
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+        return {"error": "lat/lng out of range"}, 400
+
+    if not current_app.config["LOCATION_BUFFER_ENABLED"]:
+        last_seen = Driver.update_location(current_user.id, lat, lng, data.get("label"))
+        return {"ok": True, "last_seen": last_seen.isoformat()}
+
+    # Buffered: coalesced per driver and written in bulk by the flusher thread
+    query, update = Driver.location_update(current_user.id, lat, lng, data.get("label"))
+    if not location_buffer.submit(current_user.id, query, update):
+        return {"error": "location updates are backed up, retry shortly"}, 503, {"Retry-After": "1"}
+    fields = update["$set"]
+    Driver.track_in_grid(current_user.id, lat, lng, fields["current_location"])
+    return {"ok": True, "last_seen": fields["last_seen"].isoformat(), "buffered": True}
+
+
+@main.route("/api/driver/location/stats")
+@login_required
+def driver_location_stats():
+    if current_user.role != "admin":
+        return {"error": "admins only"}, 403
+    return location_buffer.stats()
+
+
+# -------------------- DEMAND HEATMAP --------------------
+@main.route("/api/demand/tiles/<int:z>/<int:x>/<int:y>.json")
+@login_required
+def demand_tile(z, x, y):
+    """Ride requests per geohash cell inside one map tile over the last few minutes, with an ETag."""
+    if current_user.role != "driver":
+        return {"error": "drivers only"}, 403
+    if z != demand_heatmap.tile_zoom or not (0 <= x < 2 ** z and 0 <= y < 2 ** z):
+        return {"error": f"tiles are served at zoom {demand_heatmap.tile_zoom}"}, 404
+    response = jsonify(demand_heatmap.tile(z, x, y))
+    response.add_etag()
+    # Revalidate every time; an unchanged tile costs a 304 with no body
+    response.headers["Cache-Control"] = "private, no-cache"
+    return response.make_conditional(request)
+
+
 # -------------------- TRIP DETAILS --------------------
 @main.route("/trip/<trip_id>")
 @login_required
@@ -148,6 +290,115 @@ def ride_status(ride_id):
         return {"status": ride.get("status", "unknown")}
     return {"status": "not found"}
 
+@main.route("/api/dispatch/metrics")
+@login_required
+def dispatch_metrics():
+    if current_user.role != "admin":
+        return {"error": "admins only"}, 403
+    from .dispatch import dispatcher
+    return {"mode": current_app.config["DISPATCH_MODE"], **dispatcher.stats()}
+
+@main.route("/api/cache/stats")
+@login_required
+def cache_stats():
+    if current_user.role != "admin":
+        return {"error": "admins only"}, 403
+    from .cache import user_cache
+    return {"users": user_cache.stats()}
+
+@main.route("/metrics")
+def metrics():
+    """Prometheus scrape target: request latency, Mongo usage per route/collection and the in-process stats.
+
+    Scrapers send METRICS_TOKEN as a bearer token; without one configured, only admins can read it.
+    """
+    token = current_app.config["METRICS_TOKEN"]
+    if token:
+        sent = request.headers.get("Authorization", "").removeprefix("Bearer ")
+        if not hmac.compare_digest(sent.encode(), token.encode()):
+            return Response("unauthorized\n", 401, {"WWW-Authenticate": "Bearer"}, mimetype="text/plain")
+    elif not (current_user.is_authenticated and current_user.role == "admin"):
+        return {"error": "admins only"}, 403
+    from .dispatch import dispatcher
+    from .cache import user_cache
+    body = render_prometheus({
+        "ridehailing_dispatch": dispatcher.stats(),
+        "ridehailing_user_cache": user_cache.stats(),
+        "ridehailing_location_buffer": location_buffer.stats(),
+        "ridehailing_driver_grid": {"drivers": len(driver_grid)},
+        "ridehailing_ride_stream": {"subscribers": ride_hub.subscriber_count()},
+        "ridehailing_surge": pricing.surge.stats(),
+        "ridehailing_ride_events": ride_log.stats(),
+    })
+    return Response(body, mimetype="text/plain; version=0.0.4")
+
+@main.route("/api/admin/daily_stats")
+@login_required
+def admin_daily_stats():
+    """Pre-computed daily roll-ups (see `flask refresh-daily-stats`): ?from=&to= (YYYY-MM-DD), optional ?driver_id=."""
+    if current_user.role != "admin":
+        return {"error": "admins only"}, 403
+    today = datetime.utcnow().date()
+    end = parse_day(request.args.get("to"), today)
+    start = parse_day(request.args.get("from"), end and end - timedelta(days=30))
+    if not start or not end:
+        return {"error": "dates must be YYYY-MM-DD"}, 400
+    state = mongo.db.job_state.find_one({"_id": "daily_stats"}) or {}
+    return {
+        "from": start.isoformat(),
+        "to": end.isoformat(),
+        "driver_id": request.args.get("driver_id"),
+        "refreshed_through": state.get("watermark"),
+        "days": read_daily_stats(mongo.db, start, end, request.args.get("driver_id")),
+    }
+
+@main.route("/api/admin/ride_latency")
+@login_required
+def admin_ride_latency():
+    """Per-stage ride latencies replayed from the ride_events log: ?from=YYYY-MM-DD (default last 7 days)."""
+    if current_user.role != "admin":
+        return {"error": "admins only"}, 403
+    start = parse_day(request.args.get("from"), datetime.utcnow().date() - timedelta(days=7))
+    if not start:
+        return {"error": "dates must be YYYY-MM-DD"}, 400
+    states = rebuild_ride_states(mongo.db, since=datetime.combine(start, datetime.min.time()))
+    return {"from": start.isoformat(), "rides": len(states), "stages": stage_latencies(states)}
+
+@main.route("/api/ride_status/stream")
+@login_required
+def ride_status_stream():
+    """Server-Sent Events: status, ETA and match code changes for the current rider's rides."""
+    rider_id = current_user.id
+    heartbeat = current_app.config["RIDE_STREAM_HEARTBEAT_SECONDS"]
+    max_age = current_app.config["RIDE_STREAM_MAX_SECONDS"]
+
+    # Subscribe before the snapshot so nothing slips in between
+    q = ride_hub.subscribe(rider_id)
+    snapshot = [
+        ride_event(ride) for ride in mongo.db.rides.find(
+            {"rider_id": rider_id, "status": {"$in": ["pending", "accepted", "in_progress"]}},
+            {"status": 1, "eta": 1, "match_code": 1},
+        )
+    ]
+
+    def stream():
+        try:
+            yield f"retry: {heartbeat * 1000}\n\n"
+            for event in snapshot:
+                yield format_sse(event, "ride")
+            deadline = time.monotonic() + max_age
+            while time.monotonic() < deadline:
+                try:
+                    yield format_sse(q.get(timeout=heartbeat), "ride")
+                except queue.Empty:
+                    yield ": keep-alive\n\n"
+        finally:
+            ride_hub.unsubscribe(rider_id, q)
+
+    # Browsers reconnect automatically once max_age is up, which also frees the worker thread
+    return Response(stream(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
 # -------------------- CUSTOMER DASHBOARD --------------------
 @main.route("/customer")
 @login_required
@@ -156,22 +407,60 @@ def customer_dashboard():
         flash("Only customers/riders can access this dashboard.", "danger")
         return redirect(url_for("main.home"))
 
-    # Fetch this user's ride requests
-    my_rides = list(mongo.db.rides.find({"rider_id": current_user.id}))
-
-    # Check if there are available drivers
-    available_drivers = Driver.get_available_drivers()
+    # Fetch one page of this user's ride requests, newest first, with the assigned drivers joined in
+    my_rides, next_cursor = rides_with_driver(current_user.id, **page_args())
+
+    # Only load the closest drivers to the rider's latest pickup, never the whole fleet
+    limit = current_app.config["NEARBY_DRIVERS_LIMIT"]
+    pickup = None
+    for ride, _ in my_rides:
+        pickup = ride.latlng("pickup")
+        if pickup:
+            break
+    if pickup:
+        available_drivers = Driver.nearby(
+            *pickup, radius_km=current_app.config["NEARBY_DRIVERS_RADIUS_KM"], limit=limit
+        )
+    else:
+        available_drivers = Driver.get_available_drivers(limit=limit)
 
     if available_drivers:
-        flash(f"{len(available_drivers)} drivers are available. They will be notified.", "success")
+        flash(f"{len(available_drivers)} drivers are available nearby. They will be notified.", "success")
     else:
         flash("No drivers available at the moment. Please wait.", "warning")
 
-    return render_template("customer_dashboard.html", rides=my_rides, drivers=available_drivers)
+    return render_template("customer_dashboard.html", rides=my_rides, drivers=available_drivers,
+                           next_cursor=next_cursor)
+
+
+# -------------------- RIDE LISTS (JSON) --------------------
+def page_args():
+    """Keyset cursor and clamped page size from the query string (?after=<id>&limit=<n>)."""
+    return {
+        "after": request.args.get("after"),
+        "limit": clamp_limit(
+            request.args.get("limit"),
+            default=current_app.config["RIDES_PAGE_SIZE"],
+            maximum=current_app.config["RIDES_MAX_PAGE_SIZE"],
+        ),
+    }
+
+
+@main.route("/api/rides/mine")
+@login_required
+def my_rides_json():
+    rides, next_cursor = rides_with_driver(current_user.id, **page_args())
+    return {"rides": serialize({**ride.as_dict(), "driver": driver} for ride, driver in rides), "next": next_cursor}
+
+
+@main.route("/api/rides/pending")
+@login_required
+def pending_rides_json():
+    if current_user.role != "driver":
+        return {"error": "drivers only"}, 403
+    rides, next_cursor = pending_rides_with_rider(**page_args())
+    return {"rides": serialize({**ride.as_dict(), "rider": rider} for ride, rider in rides), "next": next_cursor}
 
-import random
-from datetime import datetime
-from bson import ObjectId
 
 # -------------------- DRIVER ACCEPT RIDE --------------------
 @main.route("/accept_ride/<ride_id>", methods=["POST"])
@@ -181,59 +470,47 @@ def accept_ride(ride_id):
         flash("Only drivers can accept rides.", "danger")
         return redirect(url_for("main.home"))
 
-    ride = mongo.db.rides.find_one({"_id": ObjectId(ride_id)})
-    if not ride:
+    if current_app.config["DISPATCH_MODE"] == "auto":
+        flash("Rides are being assigned automatically.", "info")
+        return redirect(url_for("main.driver_dashboard"))
+
+    if not ObjectId.is_valid(ride_id):
         flash("Ride not found.", "danger")
         return redirect(url_for("main.driver_dashboard"))
 
-    # Get driver's current location
-    driver_doc = mongo.db.drivers.find_one({"user_id": current_user.id})
-    driver_loc = driver_doc.get("current_location") if driver_doc else None
-
-    # Generate 5-digit confirmation code
-    match_code = random.randint(10000, 99999)
-
-    # Calculate ETA (if driver location is available)
-    eta = None
-    if driver_loc and ride.get("pickup"):
-        eta = calculate_eta(ride["pickup"], driver_loc, 40)
-
-    # Update ride
-    mongo.db.rides.update_one(
-        {"_id": ObjectId(ride_id)},
-        {"$set": {
-            "status": "accepted",
-            "driver_id": current_user.id,
-            "match_code": match_code,
-            "eta": eta,
-            "accepted_at": datetime.utcnow()
-        }}
-    )
+    # Driver's current location — from the in-memory grid when we have it
+    indexed = driver_grid.get(current_user.id)
+    if indexed:
+        driver_at = indexed[:2]
+    else:
+        driver_doc = mongo.db.drivers.find_one(
+            {"user_id": current_user.id}, {"current_location": 1, "location": 1}
+        ) or {}
+        driver_at = from_point(driver_doc.get("location")) or parse_latlng(driver_doc.get("current_location"))
+
+    # Claim in one conditional write — only one driver can win a pending ride — which also sets the ETA
+    ride = RideRequest.claim(ride_id, current_user.id, driver_at, match_code=random.randint(10000, 99999))
+    if not ride:
+        # Slow path, losers only: say why the claim failed
+        existing = mongo.db.rides.find_one({"_id": ObjectId(ride_id)}, {"driver_id": 1})
+        if not existing:
+            flash("Ride not found.", "danger")
+        elif existing.get("driver_id") == current_user.id:
+            flash("You have already accepted this ride.", "info")
+        else:
+            flash("Sorry, this ride has already been taken by another driver.", "warning")
+        return redirect(url_for("main.driver_dashboard"))
+
+    # Push to the rider's open status streams
+    ride_hub.publish_ride(ride)
 
     flash("Ride accepted! Customer has been notified.", "success")
     return redirect(url_for("main.driver_dashboard"))
 
 
-from math import radians, sin, cos, sqrt, atan2
-
 def calculate_eta(pickup, driver_loc, speed_kmh=40):
-    """pickup and driver_loc are strings like 'lat,lng' or 'lat,lng|place'."""
-    try:
-        # Handle "lat,lng|place"
-        pickup_coords = pickup.split("|")[0].strip()
-        driver_coords = driver_loc.split("|")[0].strip()
-
-        lat1, lon1 = map(float, pickup_coords.split(","))
-        lat2, lon2 = map(float, driver_coords.split(","))
-    except Exception:
+    """pickup and driver_loc are (lat, lng) tuples or strings like 'lat,lng' or 'lat,lng|place'."""
+    eta = estimate_eta(pickup, driver_loc, speed_kmh)
+    if eta is None:
         return "30 min"  # fallback if invalid
-
-    from math import radians, sin, cos, sqrt, atan2
-    R = 6371
-    dlat = radians(lat2 - lat1)
-    dlon = radians(lon2 - lon1)
-    a = sin(dlat/2)**2 + cos(radians(lat1)) * cos(radians(lat2)) * sin(dlon/2)**2
-    c = 2 * atan2(sqrt(a), sqrt(1-a))
-    distance = R * c
-    eta_minutes = int((distance / speed_kmh) * 60)
-    return f"{eta_minutes} min"
+    return f"{int(eta.seconds // 60)} min"
@@ -0,0 +1,161 @@
+import heapq
+import threading
+from math import cos, floor, radians, sqrt
+
+from .geo import KM_PER_DEGREE, haversine_km
+
+
+# -------------------- DRIVER GRID --------------------
+class DriverGrid:
+    """In-memory uniform grid of available driver positions.
+
+    Cells are `cell_deg` degrees square (0.005° ≈ 550 m). Upsert, move and remove
+    touch at most two cells, so they are O(1); nearest() walks rings of cells
+    outwards from the query point and stops once no unvisited cell can hold a
+    closer driver than the current k-th best.
+
+    The grid is per process: it is warmed from Mongo at startup and then fed by
+    this process's own driver writes.
+    """
+
+    def __init__(self, cell_deg=0.005):
+        self.cell_deg = cell_deg
+        self._cells = {}   # (row, col) -> {driver_id: (lat, lng, payload)}
+        self._where = {}   # driver_id -> (row, col)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._where)
+
+    def __contains__(self, driver_id):
+        return driver_id in self._where
+
+    def _cell(self, lat, lng):
+        return floor(lat / self.cell_deg), floor(lng / self.cell_deg)
+
+    def upsert(self, driver_id, lat, lng, payload=None):
+        cell = self._cell(lat, lng)
+        with self._lock:
+            old = self._where.get(driver_id)
+            if old is not None and old != cell:
+                self._discard(driver_id, old)
+            self._cells.setdefault(cell, {})[driver_id] = (lat, lng, payload)
+            self._where[driver_id] = cell
+
+    # moving is just an upsert at the new position
+    move = upsert
+
+    def remove(self, driver_id):
+        with self._lock:
+            cell = self._where.pop(driver_id, None)
+            if cell is not None:
+                self._discard(driver_id, cell)
+
+    def _discard(self, driver_id, cell):
+        bucket = self._cells.get(cell)
+        if bucket is None:
+            return
+        bucket.pop(driver_id, None)
+        if not bucket:
+            del self._cells[cell]
+
+    def get(self, driver_id):
+        """(lat, lng, payload) for a driver, or None if not indexed."""
+        with self._lock:
+            cell = self._where.get(driver_id)
+            return self._cells[cell][driver_id] if cell is not None else None
+
+    def positions(self):
+        """Snapshot of every indexed driver's (lat, lng)."""
+        with self._lock:
+            return [(lat, lng) for bucket in self._cells.values() for lat, lng, _ in bucket.values()]
+
+    def clear(self):
+        with self._lock:
+            self._cells.clear()
+            self._where.clear()
+
+    def load(self, docs):
+        """Bulk-load driver documents that carry `user_id` and a GeoJSON `location`."""
+        for doc in docs:
+            point = doc.get("location")
+            if not point:
+                continue
+            lng, lat = point["coordinates"]
+            self.upsert(doc["user_id"], lat, lng, _payload(doc))
+
+    def nearest(self, lat, lng, k=10, radius_km=None):
+        """Up to k (distance_km, driver_id, payload) tuples, nearest first."""
+        row, col = self._cell(lat, lng)
+        lng_scale = cos(radians(lat))
+        # Smallest ground distance covered by one cell step at this latitude
+        step_km = self.cell_deg * KM_PER_DEGREE * max(cos(radians(min(abs(lat) + self.cell_deg, 89.9))), 0.01)
+
+        with self._lock:
+            total = len(self._where)
+            if not total:
+                return []
+            max_ring = None
+            if radius_km is not None:
+                max_ring = int(radius_km // step_km) + 1
+
+            best = []  # max-heap of (-distance, driver_id, lat, lng, payload)
+            seen = 0
+            ring = 0
+            while True:
+                # Sparse grid far from the query point: scanning occupied cells is cheaper than more rings
+                full_scan = (2 * ring + 1) ** 2 > 4 * len(self._cells)
+                if full_scan:
+                    best = []
+                    cells = self._cells.values()
+                else:
+                    cells = filter(None, (self._cells.get(c) for c in _ring(row, col, ring)))
+
+                for bucket in cells:
+                    for driver_id, (dlat, dlng, payload) in bucket.items():
+                        seen += 1
+                        # Equirectangular distance for ranking; cheap and accurate at city scale
+                        dist = KM_PER_DEGREE * sqrt((dlat - lat) ** 2 + ((dlng - lng) * lng_scale) ** 2)
+                        if radius_km is not None and dist > radius_km:
+                            continue
+                        if len(best) < k:
+                            heapq.heappush(best, (-dist, driver_id, dlat, dlng, payload))
+                        elif dist < -best[0][0]:
+                            heapq.heapreplace(best, (-dist, driver_id, dlat, dlng, payload))
+
+                if full_scan:
+                    break
+                # Anything outside this ring is at least ring * step_km away
+                if len(best) == k and -best[0][0] <= ring * step_km:
+                    break
+                if seen >= total or (max_ring is not None and ring >= max_ring):
+                    break
+                ring += 1
+
+        # Report great-circle distances for the handful of winners
+        found = [(haversine_km(lat, lng, dlat, dlng), driver_id, payload) for _, driver_id, dlat, dlng, payload in best]
+        return sorted(found, key=lambda t: t[0])
+
+
+def _ring(row, col, r):
+    if r == 0:
+        yield row, col
+        return
+    for dc in range(-r, r + 1):
+        yield row - r, col + dc
+        yield row + r, col + dc
+    for dr in range(-r + 1, r):
+        yield row + dr, col - r
+        yield row + dr, col + r
+
+
+def _payload(doc):
+    # Just what the dashboards render, so a lookup never needs the full document
+    return {
+        "user_id": doc["user_id"],
+        "current_location": doc.get("current_location"),
+        "vehicle_details": doc.get("vehicle_details") or {},
+    }
+
+
+driver_grid = DriverGrid()
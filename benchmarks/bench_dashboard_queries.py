@@ -0,0 +1,130 @@
+"""Mongo round trips per dashboard page: per-row lookups vs the aggregation read models.
+
+Seeds one rider whose page of rides is half accepted (each by a different
+driver) and a page of pending rides from different riders, then counts the
+Mongo commands issued by
+  - the per-row way: load the page, then the users/drivers documents per row
+  - app.read_models: one $match + $lookup + $project aggregation per page
+  - GET /customer and GET /driver end to end (after a warm-up request)
+and exits non-zero if either dashboard needs more than one command.
+
+By default Mongo is mongomock (see bench_http); pass --mongo-uri to count
+against a scratch local mongod (its collections are emptied first).
+
+Run from the repo root:  python -m benchmarks.bench_dashboard_queries
+"""
+import argparse
+import os
+import random
+import sys
+
+from bson import ObjectId
+from pymongo import monitoring
+
+from benchmarks.bench_http import CommandCounter, login, seed, use_mongomock
+
+MAX_DASHBOARD_COMMANDS = 1
+
+
+def accept_page(db, rider_id, driver_docs, n):
+    """Give the rider's newest `n` rides an accepted state, each with a different driver."""
+    rides = db.rides.find({"rider_id": rider_id}, {"_id": 1}).sort("_id", -1).limit(n)
+    for ride, driver in zip(list(rides)[::2], driver_docs):
+        db.rides.update_one({"_id": ride["_id"]}, {"$set": {
+            "status": "accepted", "driver_id": driver["user_id"], "eta": "5 min", "match_code": 12345,
+        }})
+
+
+def per_row_rides(rider_id, limit):
+    from app import mongo
+    from app.models import RIDER_RIDE_FIELDS, RideRequest
+
+    rides, _ = RideRequest.for_rider(rider_id, limit=limit, fields={**RIDER_RIDE_FIELDS, "driver_id": 1})
+    for ride in rides:
+        if ride.driver_id:
+            mongo.db.users.find_one({"_id": ObjectId(ride.driver_id)}, {"name": 1, "phone": 1})
+            mongo.db.drivers.find_one({"user_id": ride.driver_id}, {"vehicle_details": 1})
+    return rides
+
+
+def per_row_pending(limit):
+    from app import mongo
+    from app.models import Driver
+
+    rides, _ = Driver.get_pending_rides(limit=limit, fields={"pickup": 1, "destination": 1, "rider_id": 1})
+    for ride in rides:
+        mongo.db.users.find_one({"_id": ObjectId(ride.rider_id)}, {"name": 1})
+    return rides
+
+
+def counted(counter, fn, *args):
+    counter.reset()
+    fn(*args)
+    return counter.count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--page", type=int, default=20, help="rides per dashboard page")
+    parser.add_argument("--mongo-uri", help="count against a real mongod instead of mongomock")
+    args = parser.parse_args()
+
+    os.environ.update({"DISPATCH_MODE": "manual", "LOCATION_BUFFER_ENABLED": "0", "PASSWORD_HASH_WORKERS": "0",
+                       "PASSWORD_HASH_METHOD": "pbkdf2:sha256:1000"})
+    counter = CommandCounter()
+    if args.mongo_uri:
+        monitoring.register(counter)
+    else:
+        use_mongomock(counter)
+
+    from app import create_app, mongo
+    from app.read_models import pending_rides_with_rider, rides_with_driver
+    from app.spatial import driver_grid
+
+    app = create_app()
+    app.config["WTF_CSRF_ENABLED"] = False
+    app.config["RIDES_PAGE_SIZE"] = args.page
+    if args.mongo_uri:
+        app.config["MONGO_URI"] = args.mongo_uri
+        mongo.init_app(app)
+
+    with app.app_context():
+        # Many riders so the pending page needs a different rider per row
+        customers, drivers, _, driver_docs = seed(mongo.db, args.page * 2, args.page, args.page * 4,
+                                                  "pbkdf2:sha256:1000", random.Random(7))
+        rider = mongo.db.users.find_one({"email": customers[0]})
+        rider_id = str(rider["_id"])
+        mongo.db.rides.insert_many([
+            {"pickup": "-1.29,36.82", "destination": "-1.30,36.80", "rider_id": rider_id, "status": "pending"}
+            for _ in range(args.page)
+        ])
+        accept_page(mongo.db, rider_id, driver_docs, args.page)
+        driver_grid.clear()
+        driver_grid.load(driver_docs)
+
+        rows = [
+            ("my rides, per-row lookups", counted(counter, per_row_rides, rider_id, args.page)),
+            ("my rides, read model", counted(counter, rides_with_driver, rider_id, None, args.page)),
+            ("pending rides, per-row lookups", counted(counter, per_row_pending, args.page)),
+            ("pending rides, read model", counted(counter, pending_rides_with_rider, None, args.page)),
+        ]
+
+    dashboards = []
+    for email, path in ((customers[0], "/customer"), (drivers[0], "/driver")):
+        client = app.test_client()
+        login(client, email)
+        client.get(path)  # warm the user cache, as in steady state
+        counter.reset()
+        status = client.get(path).status_code
+        dashboards.append((f"GET {path} ({status})", counter.count))
+
+    print(f"{args.page} rides per page, {'mongod' if args.mongo_uri else 'mongomock'}")
+    for label, count in rows + dashboards:
+        print(f"  {label:<34} {count:4d} Mongo commands")
+    too_many = [label for label, count in dashboards if count > MAX_DASHBOARD_COMMANDS]
+    if too_many:
+        sys.exit(f"more than {MAX_DASHBOARD_COMMANDS} Mongo command(s) per render: {', '.join(too_many)}")
+
+
+if __name__ == "__main__":
+    main()
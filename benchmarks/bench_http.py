@@ -0,0 +1,385 @@
+"""HTTP load benchmark for the main ride-hailing routes.
+
+Seeds users, drivers and rides, then drives login, customer_dashboard,
+driver_dashboard, request_ride, accept_ride and /api/ride_status
+concurrently through the WSGI app. For each route it reports throughput,
+p50/p95/p99 latency and Mongo commands per request, and it can write the
+results as JSON for comparing between commits.
+
+By default Mongo is mongomock (`pip install mongomock`), an in-memory
+stand-in, so runs need no server. The stand-in is not thread-safe, so its
+calls are serialized. Use --mongo-uri against a scratch local mongod for
+realistic numbers; that database is dropped first.
+
+Run from the repo root:
+    python -m benchmarks.bench_http --out before.json
+    python -m benchmarks.bench_http --out after.json --compare before.json
+"""
+import argparse
+import json
+import os
+import platform
+import queue
+import random
+import statistics
+import subprocess
+import threading
+import time
+from functools import wraps
+
+from bson import ObjectId
+from pymongo import monitoring
+from werkzeug.security import generate_password_hash
+
+PASSWORD = "bench-password"
+ROUTES = ["login", "customer_dashboard", "driver_dashboard", "request_ride", "accept_ride", "ride_status"]
+LAT_RANGE = (-1.35, -1.22)  # central Nairobi
+LNG_RANGE = (36.72, 36.90)
+
+
+# -------------------- MONGO COMMAND COUNTING --------------------
+class CommandCounter(monitoring.CommandListener):
+    """Counts Mongo commands issued by the current thread (requests run on the calling thread)."""
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def reset(self):
+        self._local.count = 0
+
+    @property
+    def count(self):
+        return getattr(self._local, "count", 0)
+
+    def bump(self):
+        self._local.count = self.count + 1
+
+    def started(self, event):
+        self.bump()
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+def use_mongomock(counter):
+    """Swap PyMongo for mongomock; count each outermost collection call as one command."""
+    import flask_pymongo
+    import mongomock
+    import mongomock.collection
+
+    client = mongomock.MongoClient()
+    lock = threading.RLock()
+    local = threading.local()
+
+    def init_app(self, app, uri=None, *args, **kwargs):
+        self.cx = client
+        self.db = client["ridehailing"]
+
+    flask_pymongo.PyMongo.init_app = init_app
+
+    def counted(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            outer = not getattr(local, "depth", 0)
+            if outer:
+                counter.bump()
+            local.depth = getattr(local, "depth", 0) + 1
+            try:
+                with lock:
+                    return fn(*args, **kwargs)
+            finally:
+                local.depth -= 1
+        return wrapper
+
+    def locked(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with lock:
+                return fn(*args, **kwargs)
+        return wrapper
+
+    # mongomock has no $convert; the read models only use it to turn string ids into ObjectIds
+    import mongomock.aggregate
+    handle_conversion = mongomock.aggregate._Parser._handle_type_convertion_operator
+
+    def convert_to_object_id(self, operator, values):
+        if operator != "$convert" or values.get("to") != "objectId":
+            return handle_conversion(self, operator, values)
+        try:
+            value = self.parse(values["input"])
+        except KeyError:
+            value = None
+        if value is None:
+            return values.get("onNull")
+        return ObjectId(value) if ObjectId.is_valid(value) else values.get("onError")
+
+    mongomock.aggregate._Parser._handle_type_convertion_operator = convert_to_object_id
+
+    # Nor update pipelines (accept_ride sets the ETA in its claim) or $round: evaluate them with aggregate
+    mongomock.aggregate.arithmetic_operators.add("$round")
+    handle_arithmetic = mongomock.aggregate._Parser._handle_arithmetic_operator
+
+    def arithmetic_with_round(self, operator, values):
+        if operator != "$round":
+            return handle_arithmetic(self, operator, values)
+        number, places = self.parse_many(values)
+        return None if number is None else round(number, places)
+
+    mongomock.aggregate._Parser._handle_arithmetic_operator = arithmetic_with_round
+    find_one_and_update = mongomock.collection.Collection.find_one_and_update
+
+    def find_one_and_update_pipeline(self, filter, update, *args, **kwargs):
+        if not isinstance(update, list):
+            return find_one_and_update(self, filter, update, *args, **kwargs)
+        before = self.find_one(filter)
+        if not before:
+            return None
+        after = next(self.aggregate([{"$match": {"_id": before["_id"]}}, *update]))
+        self.replace_one({"_id": before["_id"]}, after)
+        return after if kwargs.get("return_document") else before
+
+    mongomock.collection.Collection.find_one_and_update = find_one_and_update_pipeline
+
+    # Cursors read the store lazily, when first iterated
+    mongomock.collection.Cursor._compute_results = locked(mongomock.collection.Cursor._compute_results)
+
+    for name in ("find", "find_one", "insert_one", "insert_many", "update_one", "update_many",
+                 "find_one_and_update", "delete_one", "delete_many", "distinct", "aggregate",
+                 "count_documents", "bulk_write"):
+        setattr(mongomock.collection.Collection, name, counted(getattr(mongomock.collection.Collection, name)))
+
+
+# -------------------- SEEDING --------------------
+def random_point(rng):
+    return round(rng.uniform(*LAT_RANGE), 5), round(rng.uniform(*LNG_RANGE), 5)
+
+
+def seed(db, n_users, n_drivers, n_rides, method, rng):
+    """Returns (customer emails, driver emails, pending ride ids, driver documents)."""
+    from app.geo import to_point
+
+    for name in ("users", "drivers", "rides", "trips"):
+        db[name].delete_many({})
+    # One hash for everyone: seeding shouldn't take longer than the benchmark
+    password_hash = generate_password_hash(PASSWORD, method)
+    customers = [{"_id": ObjectId(), "name": f"Customer {i}", "email": f"customer{i}@example.com",
+                  "phone": "0700000000", "password_hash": password_hash, "role": "customer"} for i in range(n_users)]
+    drivers = [{"_id": ObjectId(), "name": f"Driver {i}", "email": f"driver{i}@example.com",
+                "phone": "0700000000", "password_hash": password_hash, "role": "driver"} for i in range(n_drivers)]
+    db.users.insert_many(customers + drivers)
+
+    driver_docs = []
+    for d in drivers:
+        lat, lng = random_point(rng)
+        driver_docs.append({
+            "user_id": str(d["_id"]), "availability": True, "current_location": f"{lat},{lng}",
+            "location": to_point(lat, lng), "vehicle_details": {"info": "Bench car"},
+        })
+    db.drivers.insert_many(driver_docs)
+
+    rides = []
+    for _ in range(n_rides):
+        rider = rng.choice(customers)
+        (plat, plng), (dlat, dlng) = random_point(rng), random_point(rng)
+        rides.append({
+            "_id": ObjectId(), "pickup": f"{plat},{plng}", "destination": f"{dlat},{dlng}",
+            "rider_id": str(rider["_id"]), "status": "pending", "driver_id": None,
+            "pickup_location": to_point(plat, plng), "destination_location": to_point(dlat, dlng),
+        })
+    db.rides.insert_many(rides)
+    return ([c["email"] for c in customers], [d["email"] for d in drivers],
+            [str(r["_id"]) for r in rides], driver_docs)
+
+
+# -------------------- LOAD --------------------
+def login(client, email):
+    return client.post("/login", data={"email": email, "password": PASSWORD})
+
+
+def run(app, customers, drivers, pending_ids, n_threads, per_route, counter, rng, mixed=False):
+    """Returns (samples per route, wall seconds per route, total wall seconds).
+
+    By default each route gets its own phase with every thread hitting it, so
+    throughput is per route; with mixed=True all routes are interleaved in one phase.
+    """
+    claimable = queue.Queue()  # each accept_ride takes a different pending ride
+    for ride_id in pending_ids:
+        claimable.put(ride_id)
+    samples = {route: [] for route in ROUTES}  # (ms, commands, ok)
+    lock = threading.Lock()
+
+    # One logged-in customer and driver session per thread, reused across phases
+    sessions = []
+    for n in range(n_threads):
+        customer, driver = app.test_client(), app.test_client()
+        login(customer, customers[n % len(customers)])
+        login(driver, drivers[n % len(drivers)])
+        sessions.append((customer, driver))
+
+    def request(route, customer, driver):
+        if route == "login":
+            return login(app.test_client(), rng.choice(customers)).status_code == 302
+        if route == "customer_dashboard":
+            return customer.get("/customer").status_code == 200
+        if route == "driver_dashboard":
+            return driver.get("/driver").status_code == 200
+        if route == "request_ride":
+            (plat, plng), (dlat, dlng) = random_point(rng), random_point(rng)
+            return customer.post("/request_ride", data={"pickup": f"{plat},{plng}",
+                                                        "destination": f"{dlat},{dlng}"}).status_code == 302
+        if route == "accept_ride":
+            return driver.post(f"/accept_ride/{claimable.get_nowait()}").status_code == 302
+        return customer.get(f"/api/ride_status/{rng.choice(pending_ids)}").status_code == 200
+
+    def worker(work, customer, driver):
+        while True:
+            try:
+                route = work.get_nowait()
+            except queue.Empty:
+                return
+            counter.reset()
+            start = time.perf_counter()
+            try:
+                ok = request(route, customer, driver)
+            except queue.Empty:  # ran out of pending rides to accept
+                continue
+            elapsed = (time.perf_counter() - start) * 1000
+            with lock:
+                samples[route].append((elapsed, counter.count, ok))
+
+    if mixed:
+        schedule = [route for route in ROUTES for _ in range(per_route)]
+        rng.shuffle(schedule)
+        phases = [(ROUTES, schedule)]
+    else:
+        phases = [([route], [route] * per_route) for route in ROUTES]
+
+    walls, total = {}, 0.0
+    for routes, schedule in phases:
+        work = queue.Queue()
+        for route in schedule:
+            work.put(route)
+        threads = [threading.Thread(target=worker, args=(work, *session)) for session in sessions]
+        start = time.perf_counter()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = time.perf_counter() - start
+        walls.update(dict.fromkeys(routes, elapsed))
+        total += elapsed
+    return samples, walls, total
+
+
+def percentile(values, p):
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100, method="inclusive")[p - 1]
+
+
+def summarize(samples, walls):
+    report = {}
+    for route, rows in samples.items():
+        if not rows:
+            continue
+        ms = [r[0] for r in rows]
+        report[route] = {
+            "requests": len(rows),
+            "errors": sum(not r[2] for r in rows),
+            "throughput_rps": round(len(rows) / walls[route], 1),
+            "p50_ms": round(percentile(ms, 50), 2),
+            "p95_ms": round(percentile(ms, 95), 2),
+            "p99_ms": round(percentile(ms, 99), 2),
+            "mongo_cmds_per_req": round(sum(r[1] for r in rows) / len(rows), 2),
+        }
+    return report
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return None
+
+
+def print_report(result, baseline=None):
+    old = (baseline or {}).get("routes", {})
+    print(f"{'route':<20} {'reqs':>5} {'err':>4} {'req/s':>8} {'p50':>8} {'p95':>8} {'p99':>8} {'cmds':>6}")
+    for route, r in result["routes"].items():
+        line = (f"{route:<20} {r['requests']:>5} {r['errors']:>4} {r['throughput_rps']:>8.1f} "
+                f"{r['p50_ms']:>8.2f} {r['p95_ms']:>8.2f} {r['p99_ms']:>8.2f} {r['mongo_cmds_per_req']:>6.2f}")
+        if route in old and old[route]["p95_ms"]:
+            line += f"  p95 {100 * (r['p95_ms'] / old[route]['p95_ms'] - 1):+.0f}%"
+            line += f"  cmds {r['mongo_cmds_per_req'] - old[route]['mongo_cmds_per_req']:+.2f}"
+        print(line)
+    print(f"total {result['total_requests']} requests in {result['wall_seconds']:.2f}s "
+          f"({result['total_requests'] / result['wall_seconds']:.1f} req/s)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--drivers", type=int, default=50)
+    parser.add_argument("--rides", type=int, default=2_000)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=200, help="requests per route")
+    parser.add_argument("--hash-method", default="pbkdf2:sha256:50000",
+                        help="password hash policy for seeded users and logins")
+    parser.add_argument("--mongo-uri", help="benchmark a real mongod instead of mongomock")
+    parser.add_argument("--mixed", action="store_true", help="interleave all routes in one phase")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--out", help="write results as JSON to this file")
+    parser.add_argument("--compare", help="print deltas against an earlier JSON result")
+    args = parser.parse_args()
+
+    # Background workers would blur the per-request numbers; passwords are hashed inline
+    os.environ.update({"DISPATCH_MODE": "manual", "LOCATION_BUFFER_ENABLED": "0",
+                       "PASSWORD_HASH_WORKERS": "0", "PASSWORD_HASH_METHOD": args.hash_method})
+    counter = CommandCounter()
+    if args.mongo_uri:
+        monitoring.register(counter)
+    else:
+        use_mongomock(counter)
+
+    from app import create_app, mongo
+    from app.spatial import driver_grid
+
+    app = create_app()
+    app.config["WTF_CSRF_ENABLED"] = False
+    if args.mongo_uri:
+        app.config["MONGO_URI"] = args.mongo_uri
+        mongo.init_app(app)
+
+    rng = random.Random(args.seed)
+    with app.app_context():
+        customers, drivers, pending, driver_docs = seed(
+            mongo.db, args.users, args.drivers, args.rides, args.hash_method, rng)
+    driver_grid.clear()
+    driver_grid.load(driver_docs)
+
+    samples, walls, wall_s = run(app, customers, drivers, pending, args.threads, args.requests, counter, rng,
+                                 args.mixed)
+    result = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "store": "mongod" if args.mongo_uri else "mongomock",
+        "params": {k: v for k, v in vars(args).items() if k not in ("out", "compare", "mongo_uri")},
+        "wall_seconds": round(wall_s, 3),
+        "total_requests": sum(len(rows) for rows in samples.values()),
+        "routes": summarize(samples, walls),
+    }
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_report(result, baseline)
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+"""Login (password verification) throughput versus hashing pool size.
+
+Simulates a burst of concurrent logins from request threads and reports
+verifications per second for inline hashing and for several pool sizes.
+
+Run from the repo root:  python -m benchmarks.bench_login [method]
+"""
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.security import generate_password_hash
+
+from app.passwords import PasswordHasher, PasswordHasherBusy, default_workers
+
+REQUEST_THREADS = 32
+LOGINS = 96
+
+
+def bench(method, workers, stored):
+    hasher = PasswordHasher(method=method, workers=workers, max_queue=LOGINS).start()
+    rejected = 0
+
+    def login(_):
+        nonlocal rejected
+        try:
+            assert hasher.verify(stored, "correct horse")
+        except PasswordHasherBusy:
+            rejected += 1
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(REQUEST_THREADS) as threads:
+        list(threads.map(login, range(LOGINS)))
+    elapsed = time.perf_counter() - start
+    hasher.shutdown()
+    label = "inline" if not workers else f"{workers} procs"
+    print(f"{label:>9} | {LOGINS / elapsed:7.1f} logins/s | {elapsed:6.2f}s for {LOGINS} | rejected {rejected}")
+
+
+if __name__ == "__main__":
+    method = sys.argv[1] if len(sys.argv) > 1 else "scrypt"
+    stored = generate_password_hash("correct horse", method)
+    print(f"method {stored.split('$', 1)[0]}, {REQUEST_THREADS} request threads")
+    sizes = sorted({0, 1, 2, 4, default_workers()})
+    for workers in sizes:
+        bench(method, workers, stored)
@@ -0,0 +1,74 @@
+"""Per-object memory of ride list entries: raw Mongo dicts vs dict-backed models vs __slots__ models.
+
+Run from the repo root:  python -m benchmarks.bench_model_memory
+
+Field values are shared between the variants, so the numbers are the
+container overhead each representation adds on top of the decoded values
+(for the __slots__ model, its change-tracking snapshot too).
+"""
+import gc
+import random
+import tracemalloc
+
+from bson import ObjectId
+
+from app.models import RIDER_RIDE_FIELDS, RideRequest, load_many
+
+N_RIDES = 100_000
+
+
+class DictRide:
+    """The ride model as it was before __slots__: every attribute in a per-instance dict."""
+
+    def __init__(self, doc):
+        self.id = str(doc["_id"])
+        self.pickup = doc.get("pickup")
+        self.destination = doc.get("destination")
+        self.rider_id = doc.get("rider_id")
+        self.status = doc.get("status", "pending")
+        self.driver_id = doc.get("driver_id")
+        self.pickup_location = doc.get("pickup_location")
+        self.destination_location = doc.get("destination_location")
+        self.eta = doc.get("eta")
+        self.match_code = doc.get("match_code")
+        self.accepted_at = doc.get("accepted_at")
+
+
+def make_docs(n, seed=3):
+    rng = random.Random(seed)
+    docs = []
+    for i in range(n):
+        lat, lng = rng.uniform(-1.45, -1.15), rng.uniform(36.65, 37.05)
+        docs.append({
+            "_id": ObjectId(),
+            "pickup": f"{lat:.5f},{lng:.5f}|Pickup {i}",
+            "pickup_location": {"type": "Point", "coordinates": [lng, lat]},
+            "destination": f"Destination {i}",
+            "status": rng.choice(["pending", "accepted", "completed"]),
+            "eta": f"{rng.randint(1, 30)} min",
+            "match_code": rng.randint(10000, 99999),
+        })
+    return docs
+
+
+def measure(label, build, docs):
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    items = build(docs)
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    print(f"{label:<32} {used / 2**20:7.1f} MiB | {used / len(items):6.0f} B/ride")
+    return used
+
+
+if __name__ == "__main__":
+    docs = make_docs(N_RIDES)
+    print(f"{N_RIDES:,} rides, {len(RIDER_RIDE_FIELDS)} projected fields")
+    raw = measure("raw dicts (before)", lambda ds: [dict(d) for d in ds], docs)
+    measure("dict-backed model", lambda ds: [DictRide(d) for d in ds], docs)
+    # Loaded from throwaway copies, as from a cursor: whatever survives is the
+    # model's steady state, clean snapshot included
+    slots = measure("__slots__ model (projected)",
+                    lambda ds: load_many(RideRequest, [dict(d) for d in ds], RIDER_RIDE_FIELDS), docs)
+    print(f"slots model, snapshot included, uses {slots / raw:.0%} of the raw-dict footprint")
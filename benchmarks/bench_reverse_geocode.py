@@ -0,0 +1,52 @@
+"""Reverse-geocoding throughput of the local place index.
+
+Run from the repo root:  python -m benchmarks.bench_reverse_geocode
+"""
+import random
+import time
+
+from app.places import Gazetteer
+
+# Roughly greater Nairobi
+LAT_RANGE = (-1.45, -1.15)
+LNG_RANGE = (36.65, 37.05)
+
+
+def build(n_places, seed=7):
+    rng = random.Random(seed)
+    gazetteer = Gazetteer()
+    for i in range(n_places):
+        gazetteer.add(f"Place {i}", rng.uniform(*LAT_RANGE), rng.uniform(*LNG_RANGE), rng.random())
+    start = time.perf_counter()
+    gazetteer.build_reverse_index()
+    return gazetteer, time.perf_counter() - start
+
+
+def bench(n_places, n_lookups=20_000, seed=11):
+    gazetteer, build_s = build(n_places)
+    rng = random.Random(seed)
+    clicks = [(rng.uniform(*LAT_RANGE), rng.uniform(*LNG_RANGE)) for _ in range(n_lookups)]
+
+    # Cold: cache disabled, every lookup walks the KD-tree
+    gazetteer.reverse_cache.enabled = False
+    start = time.perf_counter()
+    for lat, lng in clicks:
+        gazetteer.reverse(lat, lng)
+    cold = n_lookups / (time.perf_counter() - start)
+
+    # Warm: repeated clicks around a few hundred hot spots, answered per quantized cell
+    gazetteer.reverse_cache.enabled = True
+    hot = clicks[:300]
+    start = time.perf_counter()
+    for i in range(n_lookups):
+        lat, lng = hot[i % len(hot)]
+        gazetteer.reverse(lat + rng.uniform(-1e-4, 1e-4), lng + rng.uniform(-1e-4, 1e-4))
+    warm = n_lookups / (time.perf_counter() - start)
+
+    print(f"{n_places:>7} places | build {build_s:5.2f}s | kd-tree {cold:>9,.0f} lookups/s | "
+          f"cached {warm:>9,.0f} lookups/s | cache {gazetteer.reverse_cache.stats()['hits']} hits")
+
+
+if __name__ == "__main__":
+    for n in (1_000, 10_000, 100_000):
+        bench(n)
@@ -0,0 +1,52 @@
+"""Lookup latency of the in-memory driver grid.
+
+Run from the repo root:  python -m benchmarks.bench_spatial
+"""
+import random
+import time
+
+from app.spatial import DriverGrid
+
+# Roughly greater Nairobi
+LAT_RANGE = (-1.45, -1.15)
+LNG_RANGE = (36.65, 37.05)
+
+
+def random_point(rng):
+    return rng.uniform(*LAT_RANGE), rng.uniform(*LNG_RANGE)
+
+
+def bench(n_drivers, n_queries=2000, k=10, seed=42):
+    rng = random.Random(seed)
+    grid = DriverGrid()
+
+    start = time.perf_counter()
+    for i in range(n_drivers):
+        grid.upsert(f"driver-{i}", *random_point(rng), {"user_id": f"driver-{i}"})
+    load_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for i in range(n_queries):
+        grid.move(f"driver-{rng.randrange(n_drivers)}", *random_point(rng))
+    move_us = (time.perf_counter() - start) / n_queries * 1e6
+
+    queries = [random_point(rng) for _ in range(n_queries)]
+    latencies = []
+    for lat, lng in queries:
+        t0 = time.perf_counter()
+        grid.nearest(lat, lng, k=k, radius_km=10)
+        latencies.append(time.perf_counter() - t0)
+    latencies.sort()
+
+    def pct(p):
+        return latencies[int(p * (len(latencies) - 1))] * 1e6
+
+    print(
+        f"{n_drivers:>7} drivers | load {load_s:6.2f}s | move {move_us:6.1f}us | "
+        f"nearest k={k}: p50 {pct(0.50):7.1f}us  p95 {pct(0.95):7.1f}us  p99 {pct(0.99):7.1f}us"
+    )
+
+
+if __name__ == "__main__":
+    for n in (10_000, 100_000):
+        bench(n)